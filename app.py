@@ -1,9 +1,19 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import functools
 import json
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pipeline
+import profiling
+from profiling import span
+from pipeline import (
+    QUERY_BACKEND, SOURCE_FILE, cube_values, coefficient_weights, employee_labels, import_duckdb,
+)
 
 # --- Настройка страницы ---
 st.set_page_config(page_title="Аналитика ЮЦ", layout="wide", initial_sidebar_state="expanded")
@@ -58,69 +68,33 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# --- Глобальная палитра цветов ---
-COLORS_MAP = {
-    'Судебные дела': '#636EFA',
-    'Претензии': '#EF553B',
-    'Административные дела': '#00CC96',
-    'Судебные дела (мало)': '#A0A0A0',
-    'Претензии (мало)': '#B0B0B0',
-    'Административные дела (мало)': '#808080'
-}
+# --- 1. Загрузка данных ---
+@st.cache_resource
+def get_source_state(file_path):
+    return pipeline.new_source_state()
 
 
-# --- 1. Загрузка данных ---
-@st.cache_data
-def load_data():
-    df_stats = pd.DataFrame()
-    df_mapping = pd.DataFrame()
-    file_path = 'statistics.xlsx'
+def load_data(file_path=SOURCE_FILE):
+    state = get_source_state(file_path)
 
     try:
-        xls = pd.ExcelFile(file_path)
-        df_stats = pd.read_excel(xls, sheet_name=0)
-
-        if len(xls.sheet_names) > 1:
-            df_mapping_raw = pd.read_excel(xls, sheet_name=1)
-            reg_col, yuc_col = None, None
-            for col in df_mapping_raw.columns:
-                c_low = str(col).lower()
-                if not reg_col and any(x in c_low for x in ['регион', 'область', 'край', 'округ', 'республика']):
-                    reg_col = col
-                if not yuc_col and any(x in c_low for x in ['юц', 'центр']):
-                    yuc_col = col
-
-            if reg_col and yuc_col:
-                df_mapping = df_mapping_raw[[reg_col, yuc_col]].copy()
-            elif len(df_mapping_raw.columns) >= 2:
-                val = str(df_mapping_raw.iloc[0, 0])
-                if any(x in val for x in
-                       ['Дальний Восток', 'Сибирь', 'Урал', 'Поволжье', 'Северо-Запад', 'Юг', 'Центр']):
-                    df_mapping = df_mapping_raw.iloc[:, [1, 0]].copy()
-                else:
-                    df_mapping = df_mapping_raw.iloc[:, :2].copy()
-
-            if not df_mapping.empty:
-                df_mapping.columns = ['Регион', 'ЮЦ']
-                df_mapping['Регион'] = df_mapping['Регион'].astype(str).str.strip()
-                df_mapping['ЮЦ'] = df_mapping['ЮЦ'].astype(str).str.strip()
-
+        df_stats, df_mapping, data_key, pending, error = pipeline.load_source(file_path, state)
     except Exception as e:
         st.error(f"❌ Ошибка загрузки файла '{file_path}': {e}")
+        return pd.DataFrame(), pd.DataFrame(), None
 
-    if not df_stats.empty:
-        # ВАЖНО: Очищаем все ключевые текстовые поля от пробелов для корректного сравнения
-        for col in ['ЮЦ', 'Регион', 'Сотрудник']:
-            if col in df_stats.columns:
-                df_stats[col] = df_stats[col].astype(str).str.strip()
+    if pending:
+        st.sidebar.caption("⏳ Загружается обновленный файл данных, пока показаны предыдущие данные.")
+    elif error:
+        st.sidebar.warning(f"⚠️ Не удалось загрузить обновленный файл '{file_path}': {error}")
 
-    return df_stats, df_mapping
+    return df_stats, df_mapping, data_key
 
 
 # --- 2. Загрузка карты ---
-@st.cache_data
+@st.cache_resource
 def load_geojson():
-    filename = 'final_russia.geojson'
+    filename = pipeline.MAP_FILE
 
     if not os.path.exists(filename):
         st.error(f"❌ Файл карты '{filename}' не найден!")
@@ -128,64 +102,91 @@ def load_geojson():
         return None
 
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return pipeline.read_geojson(filename)
     except Exception as e:
         st.error(f"Ошибка чтения файла карты: {e}")
         return None
 
 
+@st.cache_resource
+def load_map_levels():
+    geojson = load_geojson()
+    if geojson is None:
+        return None, None
+    return pipeline.build_map_levels(geojson)
+
+
+def load_feature_index(level='Обзорная'):
+    levels, _ = load_map_levels()
+    return None if levels is None else levels[level]
+
+
 # --- 3. Вспомогательные функции ---
-def preprocess_stats(df):
-    id_vars = ['ЮЦ', 'Сотрудник']
-    if 'Регион' in df.columns:
-        id_vars.append('Регион')
-
-    value_vars = [c for c in df.columns if '20' in str(c) and '(' in str(c)]
-    df_melted = df.melt(id_vars=id_vars, value_vars=value_vars, var_name='Year_Metric', value_name='Value')
-
-    pattern = r'(\d{4})\s\((.*?)\)'
-    extracted = df_melted['Year_Metric'].str.extract(pattern)
-    df_melted['Год'] = extracted[0].astype(float).astype('Int64')
-    df_melted['Тип'] = extracted[1]
-
-    df_melted['Тип'] = df_melted['Тип'].replace({
-        'СД': 'Судебные дела',
-        'АД': 'Административные дела',
-        'претензии': 'Претензии'
-    })
-
-    return df_melted.dropna(subset=['Год', 'Тип']).drop(columns=['Year_Metric'])
-
-
-def get_fired_employees(df):
-    target_col = None
-    # Ищем колонку, содержащую слово "уволен"
-    for col in df.columns:
-        if "уволен" in str(col).strip().lower():
-            target_col = col
-            break
-
-    if target_col:
-        # Ищем любой знак 'x', 'X', 'х', 'Х' (лат/кир)
-        mask = df[target_col].astype(str).str.contains(r'[xXхХ]', na=False)
-        # Возвращаем список сотрудников (уже очищенный в load_data)
-        return set(df[mask]['Сотрудник'].unique())
-    return set()
-
-
-def get_crown_employees(df):
-    target_col = None
-    possible_names = ['работник юц', 'сотрудник юц', 'признак', 'статус', 'работник']
-    for col in df.columns:
-        if isinstance(col, str):
-            if any(key in col.lower().strip() for key in possible_names):
-                target_col = col
-                break
-    if target_col:
-        mask = df[target_col].astype(str).str.contains(r'[xXхХ]', na=False)
-        return set(df[mask]['Сотрудник'].unique())
-    return set()
+@st.cache_resource(max_entries=4, on_release=pipeline.release_dataset)
+def prepare_dataset(_df_raw, _df_map_ref, source_key):
+    # Тяжелая часть (melt + regex) считается один раз на версию книги (source_key), а не на каждый клик.
+    # cache_resource: все сессии делят один экземпляр таблицы, поэтому дальше она только читается
+    return pipeline.prepare_dataset(_df_raw, _df_map_ref, source_key)
+
+
+# Начиная с этого числа значений измерение в боковой панели показывается одним списком с поиском,
+# а не переключателем на каждое значение
+SIDEBAR_COMPACT_THRESHOLD = 12
+
+
+def sidebar_compact_filter(label, options, default, key, disabled=False):
+    # Одно состояние (список) на измерение и вкладку: стоимость перезапуска не растет с числом значений
+    if key not in st.session_state:
+        st.session_state[key] = list(default)
+
+    def set_selection(values):
+        st.session_state[key] = values
+
+    c_all, c_none = st.sidebar.columns(2)
+    c_all.button("Выбрать все", key=f"{key}_all", on_click=set_selection, args=(list(options),),
+                 disabled=disabled, use_container_width=True)
+    c_none.button("Очистить", key=f"{key}_none", on_click=set_selection, args=([],),
+                  disabled=disabled, use_container_width=True)
+    return st.sidebar.multiselect(label, options, key=key, disabled=disabled, placeholder="Поиск...",
+                                  label_visibility="collapsed")
+
+
+# Разделы, где по умолчанию выбраны все ЮЦ (в "Сотрудниках" — только первый), и год по умолчанию
+ALL_YUC_TABS = ["🏢 ЮЦ", "📈 Тренды", "🗺️ Тепловая карта"]
+DEFAULT_YEAR = 2025
+LOAD_TYPES = [('sd', "Судебные дела"), ('ad', "Административные дела"), ('pret', "Претензии")]
+ALL_LOAD_TYPES = [name for _, name in LOAD_TYPES]
+
+
+def default_yuc_selection(tab, all_yuc):
+    return list(all_yuc) if tab in ALL_YUC_TABS else list(all_yuc[:1])
+
+
+def default_year_selection(tab, all_years):
+    return list(all_years) if tab == "📈 Тренды" else [y for y in all_years if y == DEFAULT_YEAR]
+
+
+def sidebar_selection(tab, all_yuc, all_years):
+    # Выбор ЮЦ и лет раздела по состоянию его виджетов — и для раздела, который сейчас не открыт
+    if len(all_yuc) > SIDEBAR_COMPACT_THRESHOLD:
+        selected_yuc = st.session_state.get(f"sidebar_yuc_{tab}", default_yuc_selection(tab, all_yuc))
+    else:
+        default_yuc = default_yuc_selection(tab, all_yuc)
+        selected_yuc = [yc for yc in all_yuc if st.session_state.get(f"sidebar_yuc_{tab}_{yc}", yc in default_yuc)]
+
+    default_years = default_year_selection(tab, all_years)
+    if tab == "📈 Тренды":
+        selected_years = default_years
+    elif len(all_years) > SIDEBAR_COMPACT_THRESHOLD:
+        selected_years = st.session_state.get(f"sidebar_year_{tab}", default_years)
+    else:
+        selected_years = [y for y in all_years if st.session_state.get(f"sidebar_year_{tab}_{y}", y in default_years)]
+    return list(selected_yuc), list(selected_years)
+
+
+def selected_load_types(prefix):
+    # То же, что вернет get_load_type_filters(prefix) при текущем состоянии переключателей
+    return [name for suffix, name in LOAD_TYPES if st.session_state.get(f"{prefix}_{suffix}", True)]
 
 
 def get_load_type_filters(prefix, show_low_option=False):
@@ -209,26 +210,427 @@ def get_load_type_filters(prefix, show_low_option=False):
     return selected, show_low
 
 
-def apply_coefficients(df_to_modify, use_coeffs, k_sd, k_ad, k_pr):
-    if not use_coeffs:
-        return df_to_modify
+# --- 4. Кэш графиков (сами графики строятся в charts.py) ---
+# Готовые графики общие для всех сессий: повторный просмотр той же комбинации фильтров
+# не пересчитывает ни агрегаты, ни сам график. Хранится JSON-спецификация в UTF-8 (bytes), а не объект Figure:
+# ее длина — это и есть занимаемая память (строка с 👑/⚠️ занимала бы по 4 байта на символ)
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+FIGURE_CACHE_MAX_ENTRIES = 512
+# Потоки фонового построения графиков соседних разделов (0 — выключить предзагрузку)
+PREFETCH_WORKERS = int(os.environ.get('DASHBOARD_PREFETCH_WORKERS', '2'))
+
+
+@st.cache_resource
+def get_figure_cache():
+    # pending — графики, которые сейчас строятся в фоне: ключ → Future
+    return {'lock': threading.Lock(), 'entries': OrderedDict(), 'pending': {}, 'bytes': 0,
+            'hits': 0, 'misses': 0, 'prefetched': 0}
+
+
+@st.cache_resource
+def get_prefetch_pool():
+    return ThreadPoolExecutor(max_workers=max(PREFETCH_WORKERS, 1), thread_name_prefix='prefetch')
+
+
+# Слои карты (все годы × все типы) не зависят от выбора ЮЦ: одна свертка куба на версию книги,
+# коэффициенты и детализацию границ, а фигуры для разных ЮЦ собираются из нее
+MAP_LAYER_CACHE_MAX_ENTRIES = 8
+
+
+@st.cache_resource
+def get_map_layer_cache():
+    return {'lock': threading.Lock(), 'entries': OrderedDict()}
+
+
+def cached_map_layers(layer_cache, source_key, cube, feature_index, weights, detail_level):
+    key = figure_cache_key(source_key, weights, detail_level)
+    with layer_cache['lock']:
+        if key in layer_cache['entries']:
+            layer_cache['entries'].move_to_end(key)
+            return layer_cache['entries'][key]
+
+    with span('map_layers'):
+        layers = pipeline.map_layers(cube, list(feature_index), weights)
+    with layer_cache['lock']:
+        layer_cache['entries'][key] = layers
+        while len(layer_cache['entries']) > MAP_LAYER_CACHE_MAX_ENTRIES:
+            layer_cache['entries'].popitem(last=False)
+    return layers
+
+
+def figure_cache_key(*parts):
+    # Порядок выбора в списках не важен, numpy-скаляры приводим к обычным числам
+    def normalize(value):
+        if isinstance(value, dict):
+            return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple, set, frozenset, pd.Index, np.ndarray)):
+            return tuple(sorted(normalize(v) for v in value))
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    return tuple(normalize(p) for p in parts)
+
+
+def cached_figure(key, build):
+    cache = get_figure_cache()
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['entries'].move_to_end(key)
+            cache['hits'] += 1
+            profiling.count('figure_cache_hit')
+            return cache['entries'][key][0]
+        pending = cache['pending'].get(key)
+
+    # Задача еще в очереди общего пула: перед ней могут стоять задачи других сессий, поэтому снимаем ее
+    # и строим сами. Ждем только график, который уже строится; если задача упала — тоже строим сами
+    if pending is not None and not pending.cancel():
+        try:
+            with span('wait_prefetch'):
+                figure = pending.result()
+            profiling.count('figure_prefetch_hit')
+            return figure
+        except Exception:
+            pass
+
+    with cache['lock']:
+        cache['misses'] += 1
+    profiling.count('figure_cache_miss')
+
+    with span('build_figure'):
+        figure = build()
+    return store_figure(key, figure)
+
+
+def store_figure(key, figure):
+    # Возвращает то же, что и кэш: спецификацию (или кортеж спецификаций) вместо фигуры
+    cache = get_figure_cache()
+    with span('figure_to_json'):
+        if figure is None:
+            spec, size = None, 0
+        elif isinstance(figure, tuple):
+            spec = tuple(f.to_json().encode() for f in figure)
+            size = sum(len(s) for s in spec)
+        else:
+            spec = figure.to_json().encode()
+            size = len(spec)
+
+    with cache['lock']:
+        if key not in cache['entries']:
+            cache['entries'][key] = (spec, size)
+            cache['bytes'] += size
+        while cache['entries'] and (cache['bytes'] > FIGURE_CACHE_MAX_BYTES
+                                    or len(cache['entries']) > FIGURE_CACHE_MAX_ENTRIES):
+            _, (_, evicted_size) = cache['entries'].popitem(last=False)
+            cache['bytes'] -= evicted_size
+    return spec
+
+
+def plotly_chart(spec):
+    with span('plotly_chart'):
+        st.plotly_chart(json.loads(spec), use_container_width=True)
+
+
+def prefetch_one(key, build):
+    figure = store_figure(key, build())
+    cache = get_figure_cache()
+    with cache['lock']:
+        cache['prefetched'] += 1
+    return figure
+
+
+def release_pending(key, future):
+    cache = get_figure_cache()
+    with cache['lock']:
+        if cache['pending'].get(key) is future:
+            del cache['pending'][key]
+
+
+def prefetch_figures(jobs):
+    # Графики вероятных следующих разделов строятся в фоне, пока пользователь смотрит текущий.
+    # Еще не начатые задачи этой сессии для прежних фильтров снимаются
+    if PREFETCH_WORKERS <= 0:
+        return
+    cache = get_figure_cache()
+    pool = get_prefetch_pool()
+    wanted = dict(jobs)
+    previous = st.session_state.get('prefetch_futures', {})
+    for key, future in previous.items():
+        if key not in wanted:
+            future.cancel()
+
+    futures = {}
+    for key, build in wanted.items():
+        with cache['lock']:
+            if key in cache['entries']:
+                continue
+            if key in cache['pending']:
+                # Задачи других сессий не трогаем: снимать можно только свои
+                if previous.get(key) is cache['pending'][key]:
+                    futures[key] = previous[key]
+                continue
+            future = pool.submit(prefetch_one, key, build)
+            cache['pending'][key] = future
+        future.add_done_callback(functools.partial(release_pending, key))
+        futures[key] = future
+    st.session_state['prefetch_futures'] = futures
+
+
+# Ключ и построитель графика раздела: общие для самого раздела и фоновой предзагрузки,
+# чтобы предзагруженный график попадал ровно в тот ключ, который потом спросит раздел
+def yuc_figure_job(source_key, cube, selected_yuc, selected_years, types, weights, headcount, headcount_by_year):
+    from charts import build_yuc_figures
+
+    key = figure_cache_key(source_key, "🏢 ЮЦ", selected_yuc, selected_years, types, weights, headcount_by_year)
+    return key, lambda: build_yuc_figures(cube, selected_yuc, selected_years, types, headcount, weights,
+                                          headcount_by_year)
+
+
+def trend_figure_job(source_key, cube, selected_yuc, selected_years, types, weights):
+    from charts import build_trend_figure
+
+    key = figure_cache_key(source_key, "📈 Тренды", selected_yuc, selected_years, types, weights)
+    return key, lambda: build_trend_figure(cube, selected_yuc, selected_years, types, weights)
+
+
+def map_figure_job(source_key, cube, region_to_yuc, detail_level, selected_yuc, selected_years, types, weights,
+                   client_layers=False):
+    from charts import build_map_figure, build_map_layers_figure
+
+    # Геометрию и кэш слоев берем здесь, в потоке сессии: st.cache_resource из фонового потока шумит в журнале
+    feature_index = load_feature_index(detail_level)
+    if client_layers:
+        # Годы и типы переключаются в браузере: от выбора в боковой панели фигура не зависит
+        key = figure_cache_key(source_key, "🗺️ Тепловая карта", selected_yuc, weights, detail_level, client_layers)
+        layer_cache = get_map_layer_cache()
+        return key, lambda: build_map_layers_figure(
+            cached_map_layers(layer_cache, source_key, cube, feature_index, weights, detail_level),
+            region_to_yuc, feature_index, selected_yuc)
+
+    key = figure_cache_key(source_key, "🗺️ Тепловая карта", selected_yuc, selected_years, types, weights,
+                           detail_level, client_layers)
+    return key, lambda: build_map_figure(cube, region_to_yuc, feature_index, selected_yuc, selected_years, types,
+                                         weights)
+
+
+def render_profile_panel(record):
+    # Показываем только завершенную запись: в ней есть время всех стадий, включая сам раздел
+    if not record or not profiling.SHOW_PANEL:
+        return
+
+    with st.expander(f"⏱ Профиль перезапуска ({record['label']}): {record['total_ms']:.0f} мс"):
+        # Отступ показывает вложенность стадий
+        rows = [{'Стадия': '\u2003' * s['depth'] + s['name'], 'мс': s['ms']} for s in record['spans']]
+        st.dataframe(pd.DataFrame(rows, columns=['Стадия', 'мс']), hide_index=True, use_container_width=True)
+        cache = get_figure_cache()
+        st.caption(f"Кэш графиков: попаданий {cache['hits']}, промахов {cache['misses']}, "
+                   f"построено в фоне {cache['prefetched']}, записей {len(cache['entries'])}, {cache['bytes'] / 2 ** 20:.1f} МБ. "
+                   f"В этом перезапуске: {record['counters'] or 'обращений нет'}")
+
+
+def profiled_tab(render):
+    # Фрагмент перезапускается и сам по себе: такой перезапуск получает отдельную запись профиля
+    if not profiling.ENABLED:
+        return render
+
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        with profiling.rerun(f"fragment:{render.__name__}") as finished:
+            render(*args, **kwargs)
+        # В боковую панель фрагмент писать не может: профиль его перезапуска выводится в самом разделе.
+        # При полном перезапуске записи нет, профиль выводится в боковой панели в конце скрипта
+        render_profile_panel(finished)
+
+    return wrapper
+
+
+# --- 5. Разделы дашборда ---
+# Каждый раздел — фрагмент: локальные фильтры раздела перерисовывают только его,
+# а изменения в боковой панели приходят через полный перезапуск с новыми аргументами
+@st.fragment
+@profiled_tab
+def render_employees_tab(source_key, cube, selected_yuc, selected_years, weights, low_activity_set,
+                         crown_employees_set):
+    st.header("Сравнение сотрудников")
+    st.info("ℹ️ **Легенда статусов:** 👑 — Работник ЮЦ | ⚠️ — Сотрудник сейчас не работает в регионе (уволен)")
+
+    # plotly импортируется при первом построении графика, а не при старте приложения
+    from charts import (EMPLOYEE_CHART_MAX_BARS, build_employee_distribution_figure, build_employee_figure,
+                        build_employee_page_figure, build_employee_top_figure)
+
+    selected_types_emp, show_low = get_load_type_filters("emp", show_low_option=True)
+
+    raw_emps = pd.Index(cube_values(cube, 'Сотрудник', yuc=selected_yuc), dtype=object)
+    labels = employee_labels(raw_emps, crown_employees_set, low_activity_set)
+
+    # ФИЛЬТРАЦИЯ СПИСКА: Если галочка выключена, убираем уволенных
+    opts = labels.tolist() if show_low else labels[~labels.index.isin(low_activity_set)].tolist()
+    # Весь список ЮЦ выбирается переключателем, а не списком с заранее выбранными именами:
+    # иначе в браузер уходит каждое имя дважды — вариантом и выбранной плашкой
+    if st.toggle("Все сотрудники выбранных ЮЦ", value=True, key="emp_all"):
+        # "Все, кроме": выбранными в списке остаются только исключенные
+        excluded = set(st.multiselect("Исключить сотрудников:", opts, default=[], key="emp_excluded",
+                                      placeholder="Поиск по имени..."))
+        sel_display = [name for name in opts if name not in excluded]
+    else:
+        sel_display = st.multiselect("Выберите сотрудников:", opts, default=[], key="emp_selection",
+                                     placeholder="Поиск по имени...")
+        if not sel_display:
+            st.info("Выберите сотрудников в списке или включите «Все сотрудники выбранных ЮЦ».")
+
+    if sel_display:
+        if not selected_types_emp:
+            st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
+        else:
+            real_names = labels.index[labels.isin(sel_display)].tolist()
+            key_args = (source_key, "👥 Сотрудники", selected_yuc, selected_years, selected_types_emp, show_low,
+                        weights, real_names)
+
+            # Тысячи столбцов с подписями браузер не тянет: для большого выбора — первые N, страницы
+            # или распределение, у каждого число столбцов не зависит от числа сотрудников
+            view = None
+            if len(real_names) > EMPLOYEE_CHART_MAX_BARS:
+                views = [f"Первые {EMPLOYEE_CHART_MAX_BARS} и остальные", "По страницам", "Распределение"]
+                view = st.radio("Вид графика:", views, horizontal=True, key="emp_view")
+
+            if view is None:
+                fig = cached_figure(
+                    figure_cache_key(*key_args),
+                    lambda: build_employee_figure(cube, selected_yuc, selected_years, selected_types_emp,
+                                                  real_names, labels, low_activity_set, weights))
+            elif view == "По страницам":
+                pages = -(-len(real_names) // EMPLOYEE_CHART_MAX_BARS)
+                page = st.number_input(f"Страница (из {pages}):", min_value=1, max_value=pages, value=1,
+                                       key="emp_page")
+                fig = cached_figure(
+                    figure_cache_key(*key_args, view, page),
+                    lambda: build_employee_page_figure(cube, selected_yuc, selected_years, selected_types_emp,
+                                                       real_names, labels, low_activity_set, weights, page))
+            elif view == "Распределение":
+                fig = cached_figure(
+                    figure_cache_key(*key_args, view),
+                    lambda: build_employee_distribution_figure(cube, selected_yuc, selected_years,
+                                                               selected_types_emp, real_names,
+                                                               crown_employees_set, low_activity_set, weights))
+            else:
+                fig = cached_figure(
+                    figure_cache_key(*key_args, view),
+                    lambda: build_employee_top_figure(cube, selected_yuc, selected_years, selected_types_emp,
+                                                      real_names, labels, low_activity_set, weights))
+
+            if fig is None:
+                st.info("Нет данных.")
+            else:
+                plotly_chart(fig)
+
+
+@st.fragment
+@profiled_tab
+def render_yuc_tab(source_key, cube, selected_yuc, selected_years, weights, headcount):
+    st.header("Сравнение Юридических Центров")
+
+    sel_types_yuc, _ = get_load_type_filters("yuc")
+
+    if not sel_types_yuc:
+        st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
+        return
+
+    headcount_by_year = st.session_state.get('yuc_headcount_by_year', False)
+    figs = cached_figure(*yuc_figure_job(source_key, cube, selected_yuc, selected_years, sel_types_yuc, weights,
+                                         headcount, headcount_by_year))
+
+    if figs is None:
+        st.info("Нет данных по выбранным фильтрам.")
+    elif weights is not None:
+        fig_total, fig_avg = figs
+        col_total, col_eff = st.columns(2)
 
-    df_mod = df_to_modify.copy()
+        with col_total:
+            st.subheader("1. Общий объем")
+            plotly_chart(fig_total)
 
-    df_mod.loc[df_mod['Тип'] == 'Судебные дела', 'Value'] *= k_sd
-    df_mod.loc[df_mod['Тип'] == 'Административные дела', 'Value'] *= k_ad
-    df_mod.loc[df_mod['Тип'] == 'Претензии', 'Value'] *= k_pr
+        with col_eff:
+            st.subheader("2. Эффективность")
+            plotly_chart(fig_avg)
+            st.toggle("Считать штат только по выбранным годам", value=False, key="yuc_headcount_by_year",
+                      help="Учитываются сотрудники, у которых в выбранных годах есть ненулевая нагрузка")
+    else:
+        plotly_chart(figs[0])
+
+
+@st.fragment
+@profiled_tab
+def render_trends_tab(source_key, cube, selected_yuc, selected_years, weights):
+    st.header("Динамика и Тренды")
+
+    sel_types_trend, _ = get_load_type_filters("trend")
+
+    if not sel_types_trend:
+        st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
+        return
+
+    fig = cached_figure(*trend_figure_job(source_key, cube, selected_yuc, selected_years, sel_types_trend, weights))
+
+    if fig is None:
+        st.info("Нет данных по выбранным фильтрам.")
+    else:
+        plotly_chart(fig)
+
+
+@st.fragment
+@profiled_tab
+def render_map_tab(source_key, cube, region_to_yuc, selected_yuc, selected_years, weights):
+    detail_level = 'Подробная' if st.session_state.get('map_detail') else 'Обзорная'
+    feature_index = load_feature_index(detail_level)
+
+    if 'Регион' not in cube.columns:
+        st.error("❌ Не найдена колонка 'Регион' в файле Excel.")
+        return
+    if feature_index is None:
+        st.error("❌ Не удалось загрузить карту.")
+        return
+
+    client_layers = st.session_state.get('map_client_layers', False)
+    if client_layers:
+        # Год и тип выбираются в меню на самой карте: все слои уже в браузере, перезапуск не нужен
+        st.caption("Год и тип нагрузки выбираются в меню в углу карты.")
+        sel_types_map = ALL_LOAD_TYPES
+    else:
+        sel_types_map, _ = get_load_type_filters("map")
+
+    if not sel_types_map:
+        st.warning("⚠️ Выберите хотя бы один тип нагрузки, чтобы увидеть данные на карте.")
+        return
 
-    return df_mod
+    fig_map = cached_figure(*map_figure_job(source_key, cube, region_to_yuc, detail_level, selected_yuc,
+                                            selected_years, sel_types_map, weights, client_layers))
+    plotly_chart(fig_map)
+
+    c_detail, c_stats = st.columns([1, 3])
+    c_detail.toggle("Подробные границы регионов", value=False, key="map_detail")
+    if c_detail.toggle("Переключать год и тип на карте", value=False, key="map_client_layers",
+                       help="Все годы и типы нагрузки загружаются один раз, переключение — без обращения к серверу"
+                       ) != client_layers:
+        # Годы в боковой панели включаются и выключаются вместе с режимом: нужен полный перезапуск
+        st.rerun()
+    with c_stats.expander("Детализация геометрии"):
+        _, level_stats = load_map_levels()
+        st.dataframe(level_stats, hide_index=True, use_container_width=True)
 
 
 # --- START APP ---
-df_raw, df_map_ref = load_data()
+profiling.begin_rerun('script')
+
+with span('load_data'):
+    df_raw, df_map_ref, source_key = load_data()
 
 if not df_raw.empty:
-    df = preprocess_stats(df_raw)
-    low_activity_set = get_fired_employees(df_raw)
-    crown_employees_set = get_crown_employees(df_raw)
+    with span('prepare_dataset'):
+        cube, region_to_yuc, headcount, low_activity_set, crown_employees_set = prepare_dataset(df_raw, df_map_ref,
+                                                                                                source_key)
+
+    if QUERY_BACKEND == 'duckdb' and import_duckdb() is None:
+        st.sidebar.warning("⚠️ Бэкенд DuckDB недоступен (пакет duckdb не установлен), данные считаются в pandas.")
 
     # --- ИНТЕЛЛЕКТУАЛЬНАЯ НАВИГАЦИЯ ---
     selected_tab = st.radio(
@@ -238,6 +640,7 @@ if not df_raw.empty:
         label_visibility="collapsed",
         key="nav_radio"
     )
+    profiling.annotate(tab=selected_tab)
 
     # --- ДИНАМИЧЕСКАЯ БОКОВАЯ ПАНЕЛЬ ---
     st.sidebar.title("📊 Дэшборд аналитики")
@@ -246,61 +649,71 @@ if not df_raw.empty:
     st.sidebar.header("Фильтры")
 
     st.sidebar.subheader("Юридические Центры")
-    all_yuc = sorted(df['ЮЦ'].unique())
-
-    all_selected = True
-    for i, yc in enumerate(all_yuc):
-        yc_key = f"sidebar_yuc_{selected_tab}_{yc}"
-        if yc_key in st.session_state:
-            if not st.session_state[yc_key]:
-                all_selected = False
-                break
-        else:
-            default_yuc_val = True if selected_tab in ["🏢 ЮЦ", "📈 Тренды", "🗺️ Тепловая карта"] else (i == 0)
-            if not default_yuc_val:
-                all_selected = False
-                break
+    all_yuc = cube_values(cube, 'ЮЦ')
 
-    master_key = f"master_yuc_{selected_tab}"
-    st.session_state[master_key] = all_selected
+    default_yuc = default_yuc_selection(selected_tab, all_yuc)
 
+    if len(all_yuc) > SIDEBAR_COMPACT_THRESHOLD:
+        selected_yuc = sidebar_compact_filter("Юридические Центры", all_yuc, default_yuc,
+                                              key=f"sidebar_yuc_{selected_tab}")
+    else:
+        all_selected = True
+        for yc in all_yuc:
+            yc_key = f"sidebar_yuc_{selected_tab}_{yc}"
+            if yc_key in st.session_state:
+                if not st.session_state[yc_key]:
+                    all_selected = False
+                    break
+            else:
+                if yc not in default_yuc:
+                    all_selected = False
+                    break
 
-    def toggle_all_yuc_callback():
-        current_tab = st.session_state.nav_radio
-        m_key = f"master_yuc_{current_tab}"
-        master_val = st.session_state[m_key]
-        for yc_name in all_yuc:
-            st.session_state[f"sidebar_yuc_{current_tab}_{yc_name}"] = master_val
+        master_key = f"master_yuc_{selected_tab}"
+        st.session_state[master_key] = all_selected
 
 
-    st.sidebar.toggle("✅ **Включить / Выключить все**", key=master_key, on_change=toggle_all_yuc_callback)
-    st.sidebar.divider()
+        def toggle_all_yuc_callback():
+            current_tab = st.session_state.nav_radio
+            m_key = f"master_yuc_{current_tab}"
+            master_val = st.session_state[m_key]
+            for yc_name in all_yuc:
+                st.session_state[f"sidebar_yuc_{current_tab}_{yc_name}"] = master_val
 
-    selected_yuc = []
-    for i, yc in enumerate(all_yuc):
-        if selected_tab in ["🏢 ЮЦ", "📈 Тренды", "🗺️ Тепловая карта"]:
-            default_yuc_val = True
-        else:
-            default_yuc_val = (i == 0)
 
-        if st.sidebar.toggle(yc, value=default_yuc_val, key=f"sidebar_yuc_{selected_tab}_{yc}"):
-            selected_yuc.append(yc)
+        st.sidebar.toggle("✅ **Включить / Выключить все**", key=master_key, on_change=toggle_all_yuc_callback)
+        st.sidebar.divider()
 
-    df_filtered_by_yuc = df[df['ЮЦ'].isin(selected_yuc)]
+        selected_yuc = []
+        for yc in all_yuc:
+            if st.sidebar.toggle(yc, value=yc in default_yuc, key=f"sidebar_yuc_{selected_tab}_{yc}"):
+                selected_yuc.append(yc)
 
     st.sidebar.subheader("Годы")
-    all_years = sorted(df['Год'].unique())
-    selected_years = []
-    for year in all_years:
+    all_years = [int(year) for year in cube_values(cube, 'Год')]
+    # Карта со слоями в браузере: год выбирается в меню карты, переключатели лет ни на что не влияют
+    years_on_map = selected_tab == "🗺️ Тепловая карта" and st.session_state.get('map_client_layers', False)
+    if years_on_map:
+        st.sidebar.caption("Год выбирается в меню на карте.")
+
+    if len(all_years) > SIDEBAR_COMPACT_THRESHOLD:
         if selected_tab == "📈 Тренды":
-            if st.sidebar.toggle(str(year), value=True, disabled=True, key=f"sidebar_year_{selected_tab}_{year}"):
-                selected_years.append(year)
+            selected_years = sidebar_compact_filter("Годы", all_years, all_years,
+                                                    key=f"sidebar_year_{selected_tab}", disabled=True)
         else:
-            default_year_val = (year == 2025)
-            if st.sidebar.toggle(str(year), value=default_year_val, key=f"sidebar_year_{selected_tab}_{year}"):
-                selected_years.append(year)
-
-    df_main = df_filtered_by_yuc[df_filtered_by_yuc['Год'].isin(selected_years)].copy()
+            selected_years = sidebar_compact_filter("Годы", all_years, default_year_selection(selected_tab, all_years),
+                                                    key=f"sidebar_year_{selected_tab}", disabled=years_on_map)
+    else:
+        selected_years = []
+        for year in all_years:
+            if selected_tab == "📈 Тренды":
+                if st.sidebar.toggle(str(year), value=True, disabled=True, key=f"sidebar_year_{selected_tab}_{year}"):
+                    selected_years.append(year)
+            else:
+                default_year_val = (year == DEFAULT_YEAR)
+                if st.sidebar.toggle(str(year), value=default_year_val, disabled=years_on_map,
+                                     key=f"sidebar_year_{selected_tab}_{year}"):
+                    selected_years.append(year)
 
     # --- НОВЫЙ РАЗДЕЛ: ПРИВЕДЕННЫЕ ПОКАЗАТЕЛИ ---
     st.sidebar.divider()
@@ -330,297 +743,43 @@ if not df_raw.empty:
         k_pr = st.number_input("PR", value=1.00, step=0.1, format="%.2f", disabled=not use_coeffs,
                                label_visibility="collapsed", key="coeff_pr")
 
+    weights = coefficient_weights(use_coeffs, k_sd, k_ad, k_pr)
+
     # --- РЕНДЕР ВЫБРАННОГО РАЗДЕЛА ---
 
     if selected_tab == "👥 Сотрудники":
-        st.header("Сравнение сотрудников")
-        st.info("ℹ️ **Легенда статусов:** 👑 — Работник ЮЦ | ⚠️ — Сотрудник сейчас не работает в регионе (уволен)")
-
-        selected_types_emp, show_low = get_load_type_filters("emp", show_low_option=True)
-
-        raw_emps = sorted(df_filtered_by_yuc['Сотрудник'].unique())
-        emp_map = {}
-        for n in raw_emps:
-            prefix = ""
-            if n in crown_employees_set: prefix += "👑 "
-            if n in low_activity_set: prefix += "⚠️ "
-            emp_map[n] = prefix + n
-
-        # ФИЛЬТРАЦИЯ СПИСКА: Если галочка выключена, убираем уволенных
-        opts = [emp_map[n] for n in raw_emps if show_low or n not in low_activity_set]
-        sel_display = st.multiselect("Выберите сотрудников:", opts, default=opts)
-
-        if sel_display:
-            if not selected_types_emp:
-                st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
-            else:
-                rev_map = {v: k for k, v in emp_map.items()}
-                real_names = [rev_map[x] for x in sel_display]
-
-                df_sub = df_main[
-                    (df_main['Сотрудник'].isin(real_names)) &
-                    (df_main['Тип'].isin(selected_types_emp))
-                    ].copy()
-
-                if df_sub.empty:
-                    st.info("Нет данных.")
-                else:
-                    df_sub = apply_coefficients(df_sub, use_coeffs, k_sd, k_ad, k_pr)
-                    df_sub['Display'] = df_sub['Сотрудник'].map(emp_map)
-
-                    chart_title = "Сравнительная гистограмма (с учетом коэффициентов)" if use_coeffs else "Сравнительная гистограмма нагрузки"
-
-                    # --- ЛОГИКА СОРТИРОВКИ ДЛЯ ГРУППИРОВКИ ПО ЮЦ (БЕЗ МНОГОУРОВНЕВОЙ ОСИ) ---
-                    # 1. Группируем, чтобы получить сумму для каждого сотрудника
-                    emp_totals = df_sub.groupby(['Display', 'ЮЦ'])['Value'].sum().reset_index()
-
-                    # 2. Сортируем: сначала по ЮЦ (чтобы все из одного центра были рядом),
-                    #    затем по Значению (чтобы внутри центра была "лесенка")
-                    emp_totals = emp_totals.sort_values(by=['ЮЦ', 'Value'], ascending=[True, False])
-
-                    # 3. Получаем правильный порядок имен
-                    ordered_names = emp_totals['Display'].tolist()
-
-                    if use_coeffs:
-                        grp = df_sub.groupby('Display')['Value'].sum().reset_index()
-                        fig = px.bar(grp, x='Display', y='Value',
-                                     text_auto='.1f',
-                                     title=chart_title)
-                        fig.update_traces(marker_color='#636EFA')
-                    else:
-                        def cat_color(row):
-                            suffix = " (мало)" if row['Сотрудник'] in low_activity_set else ""
-                            return f"{row['Тип']}{suffix}"
-
-
-                        df_sub['Cat'] = df_sub.apply(cat_color, axis=1)
-                        grp = df_sub.groupby(['Display', 'Cat'])['Value'].sum().reset_index()
-
-                        fig = px.bar(grp, x='Display', y='Value', color='Cat',
-                                     color_discrete_map=COLORS_MAP, text_auto=True,
-                                     title=chart_title)
-
-                        new_names = {
-                            'Судебные дела': 'Судебные дела',
-                            'Претензии': 'Претензии',
-                            'Административные дела': 'Административные дела',
-                            'Судебные дела (мало)': 'Судебные дела (неактивен)',
-                            'Претензии (мало)': 'Претензии (неактивен)',
-                            'Административные дела (мало)': 'Административные дела (неактивен)'
-                        }
-                        fig.for_each_trace(lambda t: t.update(name=new_names.get(t.name, t.name)))
-
-                    # 4. Применяем принудительный порядок оси X
-                    fig.update_xaxes(categoryorder='array', categoryarray=ordered_names)
-
-                    st.plotly_chart(fig, use_container_width=True)
+        render_employees_tab(source_key, cube, selected_yuc, selected_years, weights, low_activity_set,
+                             crown_employees_set)
 
     elif selected_tab == "🏢 ЮЦ":
-        st.header("Сравнение Юридических Центров")
-
-        sel_types_yuc, _ = get_load_type_filters("yuc")
-
-        if not sel_types_yuc:
-            st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
-        else:
-            df_yuc_filtered = df_main[df_main['Тип'].isin(sel_types_yuc)].copy()
-            df_yuc_filtered = apply_coefficients(df_yuc_filtered, use_coeffs, k_sd, k_ad, k_pr)
-
-            if use_coeffs:
-                grp_yu = df_yuc_filtered.groupby('ЮЦ')['Value'].sum().reset_index()
-
-                if not grp_yu.empty:
-                    col_total, col_eff = st.columns(2)
-
-                    with col_total:
-                        st.subheader("1. Общий объем")
-                        fig_total = px.bar(grp_yu, x='ЮЦ', y='Value',
-                                           text_auto='.1f', barmode='group')
-                        fig_total.update_traces(marker_color='#636EFA')
-                        st.plotly_chart(fig_total, use_container_width=True)
-
-                    avg_data = []
-                    for index, row in grp_yu.iterrows():
-                        yc_name = row['ЮЦ']
-                        total_val = row['Value']
-
-                        employees_in_yc = df[df['ЮЦ'] == yc_name]['Сотрудник'].unique()
-                        active_count = 0
-                        for emp in employees_in_yc:
-                            if emp not in low_activity_set:
-                                active_count += 1
-
-                        ratio = total_val / active_count if active_count > 0 else 0
-                        avg_data.append(
-                            {'ЮЦ': yc_name, 'Средняя нагрузка': ratio, 'Активных сотрудников': active_count})
-
-                    df_avg = pd.DataFrame(avg_data)
-
-                    with col_eff:
-                        st.subheader("2. Эффективность")
-
-                        fig_avg = px.bar(df_avg, x='ЮЦ', y='Средняя нагрузка',
-                                         text_auto='.1f',
-                                         hover_data=['Активных сотрудников'])
-                        fig_avg.update_traces(marker_color='#EF553B')
-                        st.plotly_chart(fig_avg, use_container_width=True)
-
-                else:
-                    st.info("Нет данных по выбранным фильтрам.")
-            else:
-                grp_yu = df_yuc_filtered.groupby(['ЮЦ', 'Тип'])['Value'].sum().reset_index()
-
-                if not grp_yu.empty:
-                    fig_yu = px.bar(grp_yu, x='ЮЦ', y='Value', color='Тип',
-                                    color_discrete_map=COLORS_MAP, barmode='group', text_auto=True)
-                    st.plotly_chart(fig_yu, use_container_width=True)
-                else:
-                    st.info("Нет данных по выбранным фильтрам.")
+        render_yuc_tab(source_key, cube, selected_yuc, selected_years, weights, headcount)
 
     elif selected_tab == "📈 Тренды":
-        st.header("Динамика и Тренды")
-
-        sel_types_trend, _ = get_load_type_filters("trend")
-
-        if not sel_types_trend:
-            st.warning("⚠️ Выберите хотя бы один тип нагрузки.")
-        else:
-            df_trend_filtered = df_main[df_main['Тип'].isin(sel_types_trend)].copy()
-
-            if df_trend_filtered.empty:
-                st.info("Нет данных по выбранным фильтрам.")
-            else:
-                df_trend_filtered = apply_coefficients(df_trend_filtered, use_coeffs, k_sd, k_ad, k_pr)
-                df_grp = df_trend_filtered.groupby(['Год', 'ЮЦ'])['Value'].sum().reset_index()
-                unique_years = df_grp['Год'].unique()
-                title_suffix = " (с учетом коэффициентов)" if use_coeffs else ""
-
-                if len(unique_years) == 1:
-                    total_sum = df_grp['Value'].sum()
-                    year_val = unique_years[0]
-                    fig = px.pie(
-                        df_grp, names='ЮЦ', values='Value', color='ЮЦ',
-                        hole=0.5,
-                        title=f"Структура нагрузки по ЮЦ за {year_val} год{title_suffix}"
-                    )
-                    fig.update_traces(textposition='inside', textinfo='percent+value')
-                    fmt_sum = f"{total_sum:.1f}" if use_coeffs else f"{int(total_sum)}"
-                    fig.update_layout(
-                        annotations=[
-                            dict(text=f"<b>Всего:</b><br>{fmt_sum}", x=0.5, y=0.5, font_size=20, showarrow=False)]
-                    )
-                else:
-                    fig = px.line(df_grp, x='Год', y='Value', color='ЮЦ', markers=True)
-                    fig.update_layout(xaxis=dict(tickmode='linear', tick0=min(unique_years), dtick=1))
-
-                st.plotly_chart(fig, use_container_width=True)
+        render_trends_tab(source_key, cube, selected_yuc, selected_years, weights)
 
     elif selected_tab == "🗺️ Тепловая карта":
-        geojson = load_geojson()
-
-        if 'Регион' not in df.columns:
-            st.error("❌ Не найдена колонка 'Регион' в файле Excel.")
-        elif geojson is None:
-            st.error("❌ Не удалось загрузить карту.")
-        else:
-            sel_types_map, _ = get_load_type_filters("map")
-
-            if not sel_types_map:
-                st.warning("⚠️ Выберите хотя бы один тип нагрузки, чтобы увидеть данные на карте.")
-            else:
-                df_map_filtered = df[df['Год'].isin(selected_years)].copy()
-
-                if df_map_filtered.empty:
-                    df_pivot = pd.DataFrame(columns=['Регион', 'Судебные дела', 'Административные дела', 'Претензии'])
-                else:
-                    df_map_filtered = apply_coefficients(df_map_filtered, use_coeffs, k_sd, k_ad, k_pr)
-                    df_pivot = df_map_filtered.pivot_table(index='Регион', columns='Тип', values='Value',
-                                                           aggfunc='sum').fillna(0).reset_index()
-
-                for col in ['Судебные дела', 'Административные дела', 'Претензии']:
-                    if col not in df_pivot.columns:
-                        df_pivot[col] = 0
-
-                all_map_regs = [f['properties']['name'] for f in geojson['features']]
-                df_full = pd.DataFrame({'Регион': all_map_regs})
-
-                df_plot = pd.merge(df_full, df_pivot, on='Регион', how='left').fillna(0)
-                df_plot['Value'] = df_plot[sel_types_map].sum(axis=1)
-
-                hover_texts = []
-                for _, row in df_plot.iterrows():
-                    if row['Value'] == 0:
-                        hover_texts.append(f"<b>{row['Регион']}</b><br>нет юриста")
-                    else:
-                        lines = [f"<b>{row['Регион']}</b>"]
-                        for t in sel_types_map:
-                            val_t = row[t]
-                            fmt_val = f"{val_t:.1f}" if use_coeffs else f"{int(val_t)}"
-                            lines.append(f"{t}: {fmt_val}")
-
-                        fmt_total = f"{row['Value']:.1f}" if use_coeffs else f"{int(row['Value'])}"
-                        lines.append(f"Всего: {fmt_total}")
-                        hover_texts.append("<br>".join(lines))
-
-                df_plot['Hover_Text'] = hover_texts
-
-                region_to_yuc = {}
-                if not df_map_ref.empty:
-                    for _, row in df_map_ref.iterrows():
-                        reg = str(row['Регион']).strip()
-                        yuc = str(row['ЮЦ']).strip()
-                        if reg and yuc and reg != 'nan':
-                            region_to_yuc[reg] = yuc
-
-                if 'Регион' in df.columns:
-                    for _, row in df.iterrows():
-                        reg = str(row['Регион']).strip()
-                        yuc = str(row['ЮЦ']).strip()
-                        if reg and yuc and reg != 'nan' and reg not in region_to_yuc:
-                            region_to_yuc[reg] = yuc
-
-                df_plot['Регион_чистый'] = df_plot['Регион'].astype(str).str.strip()
-                df_plot['ЮЦ_карты'] = df_plot['Регион_чистый'].map(region_to_yuc)
-
-                selected_yuc_clean = [y.strip() for y in selected_yuc]
-                is_selected_yuc = df_plot['ЮЦ_карты'].isin(selected_yuc_clean)
-
-                df_active_selected = df_plot[(df_plot['Value'] > 0) & is_selected_yuc]
-                df_zero_selected = df_plot[(df_plot['Value'] == 0) & is_selected_yuc]
-                df_other = df_plot[~is_selected_yuc]
-
-                if not df_active_selected.empty:
-                    fig_map = px.choropleth_mapbox(
-                        df_active_selected, geojson=geojson, locations='Регион', featureidkey='properties.name',
-                        color='Value', color_continuous_scale="RdYlGn_r", mapbox_style="white-bg",
-                        opacity=0.8,
-                        custom_data=['Hover_Text'],
-                        labels={'Value': 'Нагрузка'}
-                    )
-                    fig_map.update_traces(hovertemplate="%{customdata[0]}<extra></extra>", marker_line_width=0.3,
-                                          marker_line_color='#555555')
-                else:
-                    fig_map = go.Figure(go.Choroplethmapbox(geojson=geojson, locations=[], z=[]))
-                    fig_map.update_layout(mapbox_style="white-bg")
-
-                if not df_other.empty:
-                    fig_map.add_trace(go.Choroplethmapbox(
-                        geojson=geojson, locations=df_other['Регион'], z=[1] * len(df_other),
-                        featureidkey='properties.name',
-                        colorscale=[[0, '#B0C4DE'], [1, '#B0C4DE']], showscale=False, marker_opacity=0.4,
-                        marker_line_width=0.3, marker_line_color='#555555', name='Другие ЮЦ',
-                        customdata=df_other[['Hover_Text']], hovertemplate="%{customdata[0]}<extra></extra>"
-                    ))
-
-                if not df_zero_selected.empty:
-                    fig_map.add_trace(go.Choroplethmapbox(
-                        geojson=geojson, locations=df_zero_selected['Регион'], z=[1] * len(df_zero_selected),
-                        featureidkey='properties.name',
-                        colorscale=[[0, 'gray'], [1, 'gray']], showscale=False, marker_opacity=0.6,
-                        marker_line_width=0.3, marker_line_color='#555555', name='Нет юриста',
-                        customdata=df_zero_selected[['Hover_Text']], hovertemplate="%{customdata[0]}<extra></extra>"
-                    ))
-
-                fig_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, height=800, mapbox_zoom=2.2,
-                                      mapbox_center={"lat": 65, "lon": 100})
-                st.plotly_chart(fig_map, use_container_width=True)
\ No newline at end of file
+        render_map_tab(source_key, cube, region_to_yuc, selected_yuc, selected_years, weights)
+
+    # --- ФОНОВАЯ ПРЕДЗАГРУЗКА СЛЕДУЮЩИХ РАЗДЕЛОВ ---
+    # Обычный путь — "Сотрудники" → "ЮЦ" → "Тренды" → карта: готовим графики разделов после текущего
+    # с их собственным выбором в боковой панели и общими коэффициентами
+    jobs = []
+    tabs = ["👥 Сотрудники", "🏢 ЮЦ", "📈 Тренды", "🗺️ Тепловая карта"]
+    for tab in tabs[tabs.index(selected_tab) + 1:] + tabs[1:tabs.index(selected_tab)]:
+        tab_yuc, tab_years = sidebar_selection(tab, all_yuc, all_years)
+        if tab == "🏢 ЮЦ" and selected_load_types("yuc"):
+            jobs.append(yuc_figure_job(source_key, cube, tab_yuc, tab_years, selected_load_types("yuc"), weights,
+                                       headcount, st.session_state.get('yuc_headcount_by_year', False)))
+        elif tab == "📈 Тренды" and selected_load_types("trend"):
+            jobs.append(trend_figure_job(source_key, cube, tab_yuc, tab_years, selected_load_types("trend"),
+                                         weights))
+        elif tab == "🗺️ Тепловая карта" and selected_load_types("map") and 'Регион' in cube.columns:
+            detail_level = 'Подробная' if st.session_state.get('map_detail') else 'Обзорная'
+            client_layers = st.session_state.get('map_client_layers', False)
+            map_types = ALL_LOAD_TYPES if client_layers else selected_load_types("map")
+            jobs.append(map_figure_job(source_key, cube, region_to_yuc, detail_level, tab_yuc, tab_years,
+                                       map_types, weights, client_layers))
+    prefetch_figures(jobs)
+
+with st.sidebar:
+    render_profile_panel(profiling.end_rerun())
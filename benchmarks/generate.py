@@ -0,0 +1,75 @@
+"""Генератор синтетической книги статистики в формате боевой statistics.xlsx.
+
+Лист 1: ЮЦ / Регион / Уволен / Работник ЮЦ / Сотрудник и столбцы нагрузки "ГГГГ (СД|претензии|АД)".
+Лист 2: соответствие ЮЦ → Регион. Число сотрудников, лет и регионов задается независимо.
+
+    python benchmarks/generate.py out.xlsx --employees 5000 --years 5 --regions 85
+"""
+import argparse
+
+import numpy as np
+from openpyxl import Workbook
+
+METRICS = ['СД', 'претензии', 'АД']
+LAST_YEAR = 2025
+
+
+def generate_workbook(path, employees=150, years=3, regions=80, yuc=6, seed=0, region_names=None):
+    # region_names — настоящие названия (например, из файла карты), чтобы регионы совпали с геометрией
+    rng = np.random.default_rng(seed)
+    yuc_names = [f"ЮЦ {i + 1:02d}" for i in range(yuc)]
+    if region_names is None:
+        region_names = [f"Регион {i + 1:03d}" for i in range(regions)]
+    region_names = list(region_names)[:regions]
+    regions = len(region_names)
+    # Регионы делятся между ЮЦ по кругу, сотрудник сидит в одном из регионов своего ЮЦ
+    region_yuc = {region: yuc_names[i % yuc] for i, region in enumerate(region_names)}
+    year_list = list(range(LAST_YEAR - years + 1, LAST_YEAR + 1))
+
+    wb = Workbook(write_only=True)
+    stats = wb.create_sheet('Лист1')
+    stats.append(['ЮЦ', 'Регион', 'Уволен', 'Работник ЮЦ', 'Сотрудник']
+                 + [f"{year} ({metric})" for year in year_list for metric in METRICS])
+
+    emp_regions = rng.integers(0, regions, size=employees)
+    # Средняя нагрузка: судебных дел больше всего, административных меньше
+    loads = rng.poisson(lam=[12, 8, 3], size=(employees, years, len(METRICS))).astype(float)
+    # Часть сотрудников пришла позже: ранние годы у них пустые
+    start = rng.integers(0, years, size=employees) * (rng.random(employees) < 0.3)
+    fired = rng.random(employees) < 0.2
+    crown = rng.random(employees) < 0.15
+
+    for i in range(employees):
+        region = region_names[emp_regions[i]]
+        values = loads[i].copy()
+        values[:start[i]] = np.nan
+        stats.append([
+            region_yuc[region], region,
+            ('X' if i % 2 else 'Х') if fired[i] else None,
+            'X' if crown[i] else None,
+            f"Сотрудник {i + 1:06d}",
+        ] + [None if np.isnan(v) else int(v) for v in values.ravel()])
+
+    mapping = wb.create_sheet('Лист2')
+    mapping.append(['ЮЦ', 'Регион'])
+    for region, name in region_yuc.items():
+        mapping.append([name, region])
+
+    wb.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--employees', type=int, default=150)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--regions', type=int, default=80)
+    parser.add_argument('--yuc', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_workbook(args.path, args.employees, args.years, args.regions, args.yuc, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""Нагрузочный прогон дашборда: несколько одновременных сессий одного сервера Streamlit.
+
+Харнесс запускает `streamlit run app.py` (или подключается к уже запущенному серверу, --url) и ведет
+сессии так же, как браузер: по веб-сокету, сообщениями протокола Streamlit (BackMsg / ForwardMsg).
+Все сессии делят один процесс сервера — st.cache_resource, кэш графиков, пул предзагрузки и GIL, —
+поэтому видно, когда перезапуски встают в очередь. Сессии проходят сценарии из переключений разделов,
+ЮЦ и лет, типов нагрузки и коэффициентов; каждое изменение виджета — отдельный перезапуск (виджет
+раздела — перезапуск его фрагмента), время — от отправки изменения до сообщения о завершении скрипта.
+По каждому разделу считаются p50/p95/p99 перезапуска, пропускная способность сервера при заданном
+числе сессий и пиковый RSS процесса сервера. Сбой сессии засчитывается как ошибка, замеры остальных
+сессий сохраняются.
+
+    python benchmarks/loadtest.py --sessions 8 --iterations 5
+    python benchmarks/loadtest.py --sessions 16 --employees 5000 --years 5 --output load.json
+    python benchmarks/loadtest.py --url http://127.0.0.1:8501 --sessions 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_workbook
+
+TABS = ["👥 Сотрудники", "🏢 ЮЦ", "📈 Тренды", "🗺️ Тепловая карта"]
+TYPE_PREFIX = dict(zip(TABS, ['emp', 'yuc', 'trend', 'map']))
+# Поле WidgetState, в котором браузер передает значение виджета; остальные виджеты сценарии не трогают,
+# их значения сервер берет из состояния сессии
+WIDGET_FIELDS = {'checkbox': 'bool_value', 'radio': 'string_value', 'number_input': 'double_value'}
+SERVER_START_TIMEOUT = 120
+
+
+def server_rss_mb(pid):
+    # RSS процесса сервера; для чужого сервера (--url) или не Linux — неизвестен
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_failure(message, log_path):
+    # Каталог с журналом удаляется при выходе: последние строки журнала — в само сообщение
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        tail = ''.join(f.readlines()[-20:])
+    return SystemExit(f"{message}. Журнал сервера:\n{tail}")
+
+
+def start_server(port, log_path):
+    cmd = [sys.executable, '-m', 'streamlit', 'run', os.path.join(ROOT, 'app.py'), '--server.headless', 'true',
+           '--server.port', str(port), '--server.address', '127.0.0.1', '--browser.gatherUsageStats', 'false']
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen(cmd, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise server_failure("Сервер Streamlit завершился при запуске", log_path)
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise server_failure(f"Сервер Streamlit не ответил за {SERVER_START_TIMEOUT} с", log_path)
+
+
+# --- Клиент протокола: состояние сессии — виджеты последнего перезапуска ---
+def widget_key(widget_id):
+    # Идентификатор виджета с ключом: "$$ID-<хеш>-<ключ>"
+    parts = widget_id.split('-', 2)
+    return parts[2] if len(parts) == 3 else None
+
+
+def register_widget(session, delta):
+    element = delta.new_element
+    kind = element.WhichOneof('type')
+    if kind not in WIDGET_FIELDS:
+        return
+    proto = getattr(element, kind)
+    if kind == 'radio':
+        options = list(proto.options)
+        default = options[proto.default] if proto.HasField('default') and options else None
+        server_value = proto.raw_value if proto.HasField('raw_value') else None
+    elif kind == 'checkbox':
+        default, server_value = proto.default, proto.value if proto.set_value else None
+    else:
+        default = proto.default if proto.HasField('default') else None
+        server_value = proto.value if proto.set_value and proto.HasField('value') else None
+
+    # Как в браузере: значение, заданное сервером, иначе то, что уже выбрано, иначе значение по умолчанию
+    known = session['widgets'].get(proto.id)
+    if server_value is not None:
+        value = server_value
+    elif known is not None:
+        value = known['value']
+    else:
+        value = default
+    session['seen'][proto.id] = {'id': proto.id, 'key': widget_key(proto.id), 'field': WIDGET_FIELDS[kind],
+                                 'value': value, 'disabled': proto.disabled, 'fragment_id': delta.fragment_id}
+
+
+async def rerun(session, fragment_id=''):
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    msg = BackMsg()
+    client_state = msg.rerun_script
+    client_state.fragment_id = fragment_id
+    for widget in session['widgets'].values():
+        if widget['value'] is not None:
+            state = client_state.widget_states.widgets.add()
+            state.id = widget['id']
+            setattr(state, widget['field'], widget['value'])
+    session['seen'] = {}
+    full_run, error = not fragment_id, False
+    await session['ws'].send(msg.SerializeToString())
+
+    while True:
+        reply = ForwardMsg()
+        reply.ParseFromString(await session['ws'].recv())
+        kind = reply.WhichOneof('type')
+        if kind == 'delta' and reply.delta.WhichOneof('type') == 'new_element':
+            if reply.delta.new_element.WhichOneof('type') == 'exception':
+                error = True
+            register_widget(session, reply.delta)
+        elif kind == 'script_finished':
+            if reply.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                # st.rerun(): сервер сразу запускает скрипт целиком заново, ждем конца этого запуска
+                session['seen'], full_run = {}, True
+                continue
+            error = error or reply.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR
+            break
+    # Перезапуск фрагмента присылает только его виджеты, остальные остаются на странице
+    session['widgets'] = session['seen'] if full_run else {**session['widgets'], **session['seen']}
+    return error
+
+
+def find_widget(session, key):
+    return next((w for w in session['widgets'].values() if w['key'] == key), None)
+
+
+def current_tab(session):
+    widget = find_widget(session, 'nav_radio')
+    return widget['value'] if widget else None
+
+
+# --- Шаги сценариев: список изменений (ключ виджета, значение), каждое — отдельный перезапуск ---
+def _toggle(session, key):
+    widget = find_widget(session, key)
+    return [(key, not widget['value'])] if widget and not widget['disabled'] else []
+
+
+def _tab(name):
+    def step(session, rng):
+        return [('nav_radio', name)]
+    return step
+
+
+def toggle_all_yuc(session, rng):
+    keys = [w['key'] for w in session['widgets'].values() if w['key'] and w['key'].startswith('master_yuc_')]
+    return _toggle(session, keys[0]) if keys else []
+
+
+def toggle_year(session, rng):
+    keys = [w['key'] for w in session['widgets'].values()
+            if w['key'] and w['key'].startswith('sidebar_year_') and not w['disabled']]
+    return _toggle(session, keys[rng.integers(len(keys))]) if keys else []
+
+
+def toggle_type(session, rng):
+    prefix = TYPE_PREFIX.get(current_tab(session))
+    return _toggle(session, f"{prefix}_{rng.choice(['sd', 'ad', 'pret'])}") if prefix else []
+
+
+def coeffs_on(session, rng):
+    return [('use_coeffs', True)]
+
+
+def coeffs_off(session, rng):
+    return [('use_coeffs', False)]
+
+
+def set_coeffs(session, rng):
+    return [(key, round(float(rng.uniform(0.5, 2.0)), 1)) for key in ['coeff_sd', 'coeff_ad', 'coeff_pr']]
+
+
+def map_detail(session, rng):
+    return _toggle(session, 'map_detail')
+
+
+SCENARIOS = {
+    'обзор': [_tab(TABS[0]), _tab(TABS[1]), _tab(TABS[2]), _tab(TABS[3])],
+    'руководитель ЮЦ': [_tab(TABS[1]), toggle_all_yuc, toggle_year, toggle_type, coeffs_on, set_coeffs,
+                        _tab(TABS[2]), toggle_type, coeffs_off],
+    'юрист': [_tab(TABS[0]), toggle_year, toggle_type, toggle_type, _tab(TABS[3]), toggle_type, map_detail],
+    'аналитик': [coeffs_on, set_coeffs, _tab(TABS[1]), _tab(TABS[3]), toggle_year, _tab(TABS[0]), set_coeffs,
+                 coeffs_off],
+}
+
+
+async def run_session(url, seed, iterations, think, timeout, server_pid):
+    import websockets
+
+    rng = np.random.default_rng(seed)
+    session = {'ws': None, 'widgets': {}, 'seen': {}}
+    samples = []
+
+    async def measure(label, fragment_id=''):
+        start = time.perf_counter()
+        error = await asyncio.wait_for(rerun(session, fragment_id), timeout)
+        elapsed = (time.perf_counter() - start) * 1000
+        samples.append({'tab': current_tab(session), 'step': label, 'fragment': bool(fragment_id), 'ms': elapsed,
+                        'rss_mb': server_rss_mb(server_pid), 'error': error})
+
+    label = 'open'
+    try:
+        stream_url = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        async with websockets.connect(stream_url, subprotocols=['streamlit'], max_size=None) as ws:
+            session['ws'] = ws
+            await measure(label)
+            names = list(SCENARIOS)
+            for _ in range(iterations):
+                scenario = names[rng.integers(len(names))]
+                for step in SCENARIOS[scenario]:
+                    label = f"{scenario}:{step.__name__}"
+                    for key, value in step(session, rng):
+                        widget = find_widget(session, key)
+                        if widget is None or widget['disabled'] or widget['value'] == value:
+                            continue
+                        if think:
+                            await asyncio.sleep(rng.exponential(think))
+                        widget['value'] = value
+                        await measure(label, widget['fragment_id'])
+    except Exception as e:
+        # Сессия дальше не идет: шаг засчитывается как ошибка, уже собранные замеры остаются
+        samples.append({'tab': current_tab(session), 'step': label, 'ms': None, 'rss_mb': server_rss_mb(server_pid),
+                        'error': True, 'message': f"{type(e).__name__}: {e}"})
+    return samples
+
+
+async def run_sessions(url, sessions, seed, iterations, think, timeout, server_pid):
+    return await asyncio.gather(*[run_session(url, seed + i + 1, iterations, think, timeout, server_pid)
+                                  for i in range(sessions)], return_exceptions=True)
+
+
+def summarize(samples, wall_s, failed_sessions, sessions):
+    def stats(group):
+        # Сбой без перезапуска (обрыв соединения, таймаут) времени не имеет
+        ms = np.array([s['ms'] for s in group if s['ms'] is not None] or [np.nan])
+        rss = [s['rss_mb'] for s in group if s['rss_mb'] is not None]
+        return {
+            'reruns': len(group),
+            'errors': sum(s['error'] for s in group),
+            'p50_ms': round(float(np.percentile(ms, 50)), 1),
+            'p95_ms': round(float(np.percentile(ms, 95)), 1),
+            'p99_ms': round(float(np.percentile(ms, 99)), 1),
+            'max_ms': round(float(np.max(ms)), 1),
+            'peak_rss_mb': round(max(rss), 1) if rss else None,
+        }
+
+    by_tab = {tab: stats([s for s in samples if s['tab'] == tab]) for tab in TABS
+              if any(s['tab'] == tab for s in samples)}
+    total = stats(samples)
+    total['sessions'] = sessions
+    total['failed_sessions'] = failed_sessions
+    total['wall_s'] = round(wall_s, 2)
+    total['throughput_rps'] = round(len(samples) / wall_s, 2)
+    return {'total': total, 'tabs': by_tab}
+
+
+def print_summary(summary):
+    print(f"{'раздел':<22}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'RSS, МБ':>10}")
+    for tab, s in list(summary['tabs'].items()) + [('всего', summary['total'])]:
+        rss = '—' if s['peak_rss_mb'] is None else f"{s['peak_rss_mb']:.0f}"
+        print(f"{tab:<22}{s['reruns']:>6}{s['p50_ms']:>9.0f}{s['p95_ms']:>9.0f}{s['p99_ms']:>9.0f}{rss:>10}")
+    total = summary['total']
+    print(f"\nПропускная способность сервера при {total['sessions']} сессиях: {total['throughput_rps']} "
+          f"перезапусков/с за {total['wall_s']} с, ошибок: {total['errors']}, "
+          f"сбойных сессий: {total['failed_sessions']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=4, help="одновременных сессий")
+    parser.add_argument('--iterations', type=int, default=3, help="сценариев на сессию")
+    parser.add_argument('--think', type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument('--timeout', type=float, default=120.0, help="предел одного перезапуска, с")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="уже запущенный сервер (например, http://127.0.0.1:8501) вместо своего")
+    parser.add_argument('--employees', type=int, help="синтетическая книга вместо statistics.xlsx")
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--yuc', type=int, default=6)
+    parser.add_argument('--output', help="JSON со сводкой и всеми замерами")
+    args = parser.parse_args()
+    if args.url and args.employees:
+        parser.error("--employees задает книгу своего сервера и несовместим с --url")
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.employees:
+        # Регионы — из файла карты, чтобы тепловая карта строилась как на боевых данных
+        with open(os.path.join(ROOT, 'final_russia.geojson'), encoding='utf-8') as f:
+            regions = [feature['properties']['name'] for feature in json.load(f)['features']]
+        workbook = generate_workbook(os.path.join(tmp.name, 'statistics.xlsx'), args.employees, args.years,
+                                     len(regions), args.yuc, args.seed, region_names=regions)
+        # Сервер наследует окружение: pipeline читает источник при импорте
+        os.environ['DASHBOARD_SOURCE'] = workbook
+
+    server = None
+    if args.url:
+        url = args.url
+    else:
+        port = free_port()
+        server = start_server(port, os.path.join(tmp.name, 'server.log'))
+        url = f'http://127.0.0.1:{port}'
+    server_pid = server.pid if server else None
+
+    try:
+        # Прогрев одной сессией: разбор книги и подготовка данных не должны попасть в замеры
+        warm_up = asyncio.run(run_session(url, args.seed, 0, 0, args.timeout, server_pid))
+        if any(s['error'] for s in warm_up):
+            raise SystemExit(f"Приложение не открылось: {warm_up[-1].get('message', 'ошибка в скрипте')}")
+
+        start = time.perf_counter()
+        results = asyncio.run(run_sessions(url, args.sessions, args.seed, args.iterations, args.think,
+                                           args.timeout, server_pid))
+        wall_s = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        tmp.cleanup()
+
+    samples, failed_sessions = [], 0
+    for result in results:
+        if isinstance(result, BaseException):
+            failed_sessions += 1
+            print(f"Сессия завершилась сбоем: {type(result).__name__}: {result}")
+        else:
+            samples.extend(result)
+    if not samples:
+        raise SystemExit(f"Ни одна сессия не дала замеров, сбойных сессий: {failed_sessions}")
+
+    summary = summarize(samples, wall_s, failed_sessions, args.sessions)
+    print_summary(summary)
+    if args.output:
+        report = {'params': vars(args), 'summary': summary, 'samples': samples}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
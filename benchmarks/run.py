@@ -0,0 +1,155 @@
+"""Замер стадий конвейера данных на синтетической книге.
+
+Каждая стадия запускается --repeat раз, в JSON пишутся минимум, медиана и все прогоны (мс),
+а также параметры книги и версии окружения — файлы разных версий кода можно сравнивать:
+
+    python benchmarks/run.py --employees 5000 --years 5 --output before.json
+    python benchmarks/run.py --employees 5000 --years 5 --output after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+import pipeline
+from benchmarks.generate import generate_workbook
+
+ALL_TYPES = ['Судебные дела', 'Административные дела', 'Претензии']
+WEIGHTS = {'Судебные дела': 1.5, 'Административные дела': 0.7, 'Претензии': 2.0}
+
+
+def time_stage(results, name, fn, repeat):
+    runs, value = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        runs.append((time.perf_counter() - start) * 1000)
+    results[name] = {
+        'min_ms': round(min(runs), 3),
+        'median_ms': round(statistics.median(runs), 3),
+        'runs_ms': [round(r, 3) for r in runs],
+    }
+    return value
+
+
+def run_benchmarks(workbook, repeat):
+    stages = {}
+
+    df_raw, df_map_ref = time_stage(stages, 'excel_load', lambda: pipeline.read_workbook(workbook), repeat)
+    key, _ = pipeline.source_fingerprint(workbook)
+    pipeline.write_sidecar(workbook, key, df_raw, df_map_ref)
+    time_stage(stages, 'sidecar_load', lambda: pipeline.read_sidecar(workbook, key), repeat)
+
+    df = time_stage(stages, 'preprocess_stats', lambda: pipeline.preprocess_stats(df_raw), repeat)
+    low_activity_set, crown_employees_set = time_stage(
+        stages, 'status_sets',
+        lambda: (pipeline.get_fired_employees(df_raw), pipeline.get_crown_employees(df_raw)), repeat)
+    cube = time_stage(stages, 'build_cube', lambda: pipeline.build_cube(df), repeat)
+    region_to_yuc = time_stage(stages, 'region_index', lambda: pipeline.build_region_index(df, df_map_ref), repeat)
+    headcount = time_stage(stages, 'headcount_index',
+                           lambda: pipeline.build_headcount_index(cube, low_activity_set), repeat)
+    time_stage(stages, 'apply_coefficients', lambda: pipeline.weighted_values(cube, WEIGHTS), repeat)
+
+    # Фильтры как у открытой по умолчанию страницы с включенными коэффициентами: все ЮЦ, последний год
+    all_yuc = pipeline.cube_values(cube, 'ЮЦ')
+    years = pipeline.cube_values(cube, 'Год')[-1:]
+    employees = pipeline.cube_values(cube, 'Сотрудник', yuc=all_yuc)
+
+    def employees_tab():
+        labels = pipeline.employee_labels(employees, crown_employees_set, low_activity_set)
+        grp = pipeline.cube_rollup(cube, ['ЮЦ', 'Сотрудник', 'Тип'], WEIGHTS, yuc=all_yuc, years=years,
+                                   types=ALL_TYPES, employees=employees)
+        return labels, grp
+
+    def yuc_tab():
+        grp = pipeline.cube_rollup(cube, ['ЮЦ'], WEIGHTS, yuc=all_yuc, years=years, types=ALL_TYPES)
+        return grp['ЮЦ'].map(pipeline.active_headcount(headcount, years))
+
+    time_stage(stages, 'tab_employees', employees_tab, repeat)
+    time_stage(stages, 'tab_yuc', yuc_tab, repeat)
+    time_stage(stages, 'tab_trends', lambda: pipeline.cube_rollup(cube, ['Год', 'ЮЦ'], WEIGHTS, yuc=all_yuc,
+                                                                  types=ALL_TYPES), repeat)
+    regions = sorted(set(region_to_yuc))
+    time_stage(stages, 'map_hover_regions',
+               lambda: pipeline.map_frame(cube, region_to_yuc, regions, all_yuc, years, ALL_TYPES, WEIGHTS),
+               repeat)
+
+    shape = {'raw_rows': len(df_raw), 'long_rows': len(df), 'cube_rows': len(cube), 'regions': len(regions)}
+    return stages, shape
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def print_report(stages, baseline=None):
+    base = (baseline or {}).get('stages', {})
+    for name, result in stages.items():
+        line = f"{name:<20} {result['median_ms']:>10.1f} ms"
+        if name in base and base[name]['median_ms'] > 0:
+            line += f"   x{result['median_ms'] / base[name]['median_ms']:.2f} к базе"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--employees', type=int, default=150)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--regions', type=int, default=80)
+    parser.add_argument('--yuc', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workbook', help="готовая книга вместо синтетической")
+    parser.add_argument('--output', help="путь к JSON с результатами (по умолчанию benchmarks/results/)")
+    parser.add_argument('--baseline', help="JSON прошлого запуска для сравнения медиан")
+    args = parser.parse_args()
+
+    params = {k: getattr(args, k) for k in ['employees', 'years', 'regions', 'yuc', 'seed', 'repeat']}
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.workbook:
+            workbook, params = args.workbook, {'workbook': args.workbook, 'repeat': args.repeat}
+        else:
+            workbook = generate_workbook(os.path.join(tmp, 'statistics.xlsx'), args.employees, args.years,
+                                         args.regions, args.yuc, args.seed)
+        stages, shape = run_benchmarks(workbook, args.repeat)
+
+    report = {'environment': environment(), 'params': params, 'shape': shape, 'stages': stages}
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{datetime.now():%Y%m%d-%H%M%S}-{report['environment']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(stages, baseline)
+    print(f"\nРезультаты: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""Построение графиков plotly по данным из pipeline.
+
+Импортируется лениво, из раздела, которому нужен график: plotly не грузится, пока графиков нет.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from pipeline import active_headcount, cube_rollup, feature_collection, map_frame
+
+# --- Глобальная палитра цветов ---
+COLORS_MAP = {
+    'Судебные дела': '#636EFA',
+    'Претензии': '#EF553B',
+    'Административные дела': '#00CC96',
+    'Судебные дела (мало)': '#A0A0A0',
+    'Претензии (мало)': '#B0B0B0',
+    'Административные дела (мало)': '#808080'
+}
+
+
+# Больше столбцов на одном графике сотрудников не рисуем: первые N с "остальными" или страницы по N
+EMPLOYEE_CHART_MAX_BARS = 200
+# Число интервалов гистограммы распределения нагрузки
+EMPLOYEE_HISTOGRAM_BINS = 40
+
+
+def employee_rollup(cube, selected_yuc, selected_years, types, real_names, labels, weights):
+    # Одна свертка куба дает и стопки по типам, и суммы для сортировки
+    grp = cube_rollup(cube, ['ЮЦ', 'Сотрудник', 'Тип'], weights, yuc=selected_yuc,
+                      years=selected_years, types=types, employees=real_names)
+    # Подписи — строки: порядок на оси при равной нагрузке задается алфавитом подписей
+    grp['Display'] = grp['Сотрудник'].map(labels).astype(str)
+    return grp
+
+
+def employee_order(grp):
+    # --- ЛОГИКА СОРТИРОВКИ ДЛЯ ГРУППИРОВКИ ПО ЮЦ (БЕЗ МНОГОУРОВНЕВОЙ ОСИ) ---
+    # Сначала по ЮЦ (чтобы все из одного центра были рядом), затем по сумме (чтобы внутри центра была "лесенка")
+    emp_totals = grp.groupby(['Display', 'ЮЦ'], observed=True)['Value'].sum().reset_index()
+    return emp_totals.sort_values(by=['ЮЦ', 'Value', 'Display'], ascending=[True, False, True])['Display'].tolist()
+
+
+def build_employee_figure(cube, selected_yuc, selected_years, types, real_names, labels, low_activity_set,
+                          weights):
+    grp = employee_rollup(cube, selected_yuc, selected_years, types, real_names, labels, weights)
+    if grp.empty:
+        return None
+    return employee_bar_figure(grp, employee_order(grp), low_activity_set, weights)
+
+
+def employee_bar_figure(grp, ordered_names, low_activity_set, weights, title_suffix=""):
+    use_coeffs = weights is not None
+    chart_title = "Сравнительная гистограмма (с учетом коэффициентов)" if use_coeffs else "Сравнительная гистограмма нагрузки"
+    chart_title += title_suffix
+
+    if use_coeffs:
+        grp = grp.groupby('Display')['Value'].sum().reset_index()
+        fig = px.bar(grp, x='Display', y='Value',
+                     text_auto='.1f',
+                     title=chart_title)
+        fig.update_traces(marker_color='#636EFA')
+    else:
+        grp['Cat'] = grp['Тип'].astype(str) + np.where(grp['Сотрудник'].isin(low_activity_set), " (мало)", "")
+        grp = grp.groupby(['Display', 'Cat'])['Value'].sum().reset_index()
+
+        fig = px.bar(grp, x='Display', y='Value', color='Cat',
+                     color_discrete_map=COLORS_MAP, text_auto=True,
+                     title=chart_title)
+
+        new_names = {
+            'Судебные дела': 'Судебные дела',
+            'Претензии': 'Претензии',
+            'Административные дела': 'Административные дела',
+            'Судебные дела (мало)': 'Судебные дела (неактивен)',
+            'Претензии (мало)': 'Претензии (неактивен)',
+            'Административные дела (мало)': 'Административные дела (неактивен)'
+        }
+        fig.for_each_trace(lambda t: t.update(name=new_names.get(t.name, t.name)))
+
+    # Применяем принудительный порядок оси X
+    fig.update_xaxes(categoryorder='array', categoryarray=ordered_names)
+    return fig
+
+
+def build_employee_top_figure(cube, selected_yuc, selected_years, types, real_names, labels, low_activity_set,
+                              weights, top_n=EMPLOYEE_CHART_MAX_BARS):
+    # Первые top_n сотрудников по нагрузке, остальные — одним столбцом "Остальные" в конце своего ЮЦ
+    grp = employee_rollup(cube, selected_yuc, selected_years, types, real_names, labels, weights)
+    if grp.empty:
+        return None
+
+    totals = grp.groupby(['ЮЦ', 'Сотрудник', 'Display'], observed=True)['Value'].sum().reset_index()
+    top = totals.sort_values(by=['Value', 'Display'], ascending=[False, True]).head(top_n)
+    is_top = grp['Сотрудник'].isin(top['Сотрудник'])
+
+    rest = grp[~is_top]
+    rest_count = rest.groupby('ЮЦ', observed=True)['Сотрудник'].nunique()
+    others = rest.groupby(['ЮЦ', 'Тип'], observed=True)['Value'].sum().reset_index()
+    # Вместо имени — подпись столбца: в списках уволенных ее нет, "неактивным" столбец не станет
+    others['Сотрудник'] = others['Display'] = [f"Остальные · {yc} ({rest_count[yc]})" for yc in others['ЮЦ']]
+
+    top = top.sort_values(by=['ЮЦ', 'Value', 'Display'], ascending=[True, False, True])
+    ordered_names = []
+    for yc in sorted(set(top['ЮЦ']) | set(rest_count.index)):
+        ordered_names += top.loc[top['ЮЦ'] == yc, 'Display'].tolist()
+        if yc in rest_count.index:
+            ordered_names.append(f"Остальные · {yc} ({rest_count[yc]})")
+
+    frame = pd.concat([grp[is_top], others[grp.columns]], ignore_index=True)
+    suffix = f": первые {len(top)} из {len(totals)}"
+    return employee_bar_figure(frame, ordered_names, low_activity_set, weights, suffix)
+
+
+def build_employee_page_figure(cube, selected_yuc, selected_years, types, real_names, labels, low_activity_set,
+                               weights, page, page_size=EMPLOYEE_CHART_MAX_BARS):
+    # Страница списка в том же порядке, что и полный график: по ЮЦ, внутри ЮЦ — по убыванию нагрузки
+    grp = employee_rollup(cube, selected_yuc, selected_years, types, real_names, labels, weights)
+    ordered_names = employee_order(grp)
+    pages = max(1, -(-len(ordered_names) // page_size))
+    page = min(max(page, 1), pages)
+    names = ordered_names[(page - 1) * page_size:page * page_size]
+    if not names:
+        return None
+
+    frame = grp[grp['Display'].isin(names)].copy()
+    return employee_bar_figure(frame, names, low_activity_set, weights, f": страница {page} из {pages}")
+
+
+def build_employee_distribution_figure(cube, selected_yuc, selected_years, types, real_names, crown_employees_set,
+                                       low_activity_set, weights, bins=EMPLOYEE_HISTOGRAM_BINS):
+    # Распределение нагрузки всех выбранных сотрудников: интервалы считаются на сервере,
+    # в браузер уходит по столбцу на интервал и ЮЦ независимо от числа сотрудников
+    grp = cube_rollup(cube, ['ЮЦ', 'Сотрудник'], weights, yuc=selected_yuc, years=selected_years, types=types,
+                      employees=real_names)
+    if grp.empty:
+        return None
+
+    values = grp['Value'].to_numpy(dtype='float64')
+    edges = np.histogram_bin_edges(values, bins=bins)
+    centers, widths = (edges[:-1] + edges[1:]) / 2, np.diff(edges)
+    fmt = "%.1f" if weights is not None else "%.0f"
+    ranges = [f"{fmt % lo} – {fmt % hi}" for lo, hi in zip(edges[:-1], edges[1:])]
+
+    fig = go.Figure()
+    for yc, part in grp.groupby('ЮЦ', observed=True):
+        part_values = part['Value'].to_numpy(dtype='float64')
+        counts, _ = np.histogram(part_values, bins=edges)
+        # Статусы сохраняются в виде счетчиков: сколько в интервале работников ЮЦ (👑) и уволенных (⚠️)
+        crown, _ = np.histogram(part_values[part['Сотрудник'].isin(crown_employees_set).to_numpy()], bins=edges)
+        fired, _ = np.histogram(part_values[part['Сотрудник'].isin(low_activity_set).to_numpy()], bins=edges)
+        fig.add_trace(go.Bar(
+            x=centers, y=counts, width=widths, name=str(yc),
+            customdata=np.column_stack([ranges, crown, fired]),
+            hovertemplate=f"<b>{yc}</b><br>Нагрузка: %{{customdata[0]}}<br>Сотрудников: %{{y}}"
+                          "<br>👑: %{customdata[1]} | ⚠️: %{customdata[2]}<extra></extra>"
+        ))
+
+    title = "Распределение нагрузки сотрудников" + (" (с учетом коэффициентов)" if weights is not None else "")
+    fig.update_layout(barmode='stack', bargap=0, title=title, xaxis_title="Нагрузка за выбранные годы",
+                      yaxis_title="Сотрудников", legend_title_text="ЮЦ")
+    return fig
+
+
+def build_yuc_figures(cube, selected_yuc, selected_years, types, headcount, weights, headcount_by_year=False):
+    if weights is None:
+        grp_yu = cube_rollup(cube, ['ЮЦ', 'Тип'], yuc=selected_yuc, years=selected_years, types=types)
+        if grp_yu.empty:
+            return None
+
+        fig_yu = px.bar(grp_yu, x='ЮЦ', y='Value', color='Тип',
+                        color_discrete_map=COLORS_MAP, barmode='group', text_auto=True)
+        return (fig_yu,)
+
+    grp_yu = cube_rollup(cube, ['ЮЦ'], weights, yuc=selected_yuc, years=selected_years, types=types)
+    if grp_yu.empty:
+        return None
+
+    fig_total = px.bar(grp_yu, x='ЮЦ', y='Value',
+                       text_auto='.1f', barmode='group')
+    fig_total.update_traces(marker_color='#636EFA')
+
+    staff = active_headcount(headcount, selected_years if headcount_by_year else None)
+    active_count = grp_yu['ЮЦ'].map(staff).fillna(0).astype(int)
+    ratio = grp_yu['Value'] / active_count.where(active_count > 0)
+    df_avg = pd.DataFrame({'ЮЦ': grp_yu['ЮЦ'], 'Средняя нагрузка': ratio.fillna(0),
+                           'Активных сотрудников': active_count})
+
+    fig_avg = px.bar(df_avg, x='ЮЦ', y='Средняя нагрузка',
+                     text_auto='.1f',
+                     hover_data=['Активных сотрудников'])
+    fig_avg.update_traces(marker_color='#EF553B')
+    return fig_total, fig_avg
+
+
+def build_trend_figure(cube, selected_yuc, selected_years, types, weights):
+    use_coeffs = weights is not None
+    df_grp = cube_rollup(cube, ['Год', 'ЮЦ'], weights, yuc=selected_yuc, years=selected_years, types=types)
+    if df_grp.empty:
+        return None
+
+    unique_years = df_grp['Год'].unique()
+    title_suffix = " (с учетом коэффициентов)" if use_coeffs else ""
+
+    if len(unique_years) == 1:
+        total_sum = df_grp['Value'].sum()
+        year_val = unique_years[0]
+        fig = px.pie(
+            df_grp, names='ЮЦ', values='Value', color='ЮЦ',
+            hole=0.5,
+            title=f"Структура нагрузки по ЮЦ за {year_val} год{title_suffix}"
+        )
+        fig.update_traces(textposition='inside', textinfo='percent+value')
+        fmt_sum = f"{total_sum:.1f}" if use_coeffs else f"{int(total_sum)}"
+        fig.update_layout(
+            annotations=[
+                dict(text=f"<b>Всего:</b><br>{fmt_sum}", x=0.5, y=0.5, font_size=20, showarrow=False)]
+        )
+    else:
+        fig = px.line(df_grp, x='Год', y='Value', color='ЮЦ', markers=True)
+        fig.update_layout(xaxis=dict(tickmode='linear', tick0=min(unique_years), dtick=1))
+    return fig
+
+
+def build_map_figure(cube, region_to_yuc, feature_index, selected_yuc, selected_years, types, weights):
+    df_plot = map_frame(cube, region_to_yuc, feature_index, selected_yuc, selected_years, types, weights)
+    is_selected_yuc = df_plot['Выбран']
+
+    df_active_selected = df_plot[(df_plot['Value'] > 0) & is_selected_yuc]
+    df_zero_selected = df_plot[(df_plot['Value'] == 0) & is_selected_yuc]
+    df_other = df_plot[~is_selected_yuc]
+
+    if not df_active_selected.empty:
+        fig_map = px.choropleth_mapbox(
+            df_active_selected, geojson=feature_collection(feature_index, df_active_selected['Регион']),
+            locations='Регион', featureidkey='properties.name',
+            color='Value', color_continuous_scale="RdYlGn_r", mapbox_style="white-bg",
+            opacity=0.8,
+            custom_data=['Hover_Text'],
+            labels={'Value': 'Нагрузка'}
+        )
+        fig_map.update_traces(hovertemplate="%{customdata[0]}<extra></extra>", marker_line_width=0.3,
+                              marker_line_color='#555555')
+    else:
+        fig_map = go.Figure(go.Choroplethmapbox(geojson=feature_collection(feature_index, []),
+                                                locations=[], z=[]))
+        fig_map.update_layout(mapbox_style="white-bg")
+
+    if not df_other.empty:
+        fig_map.add_trace(go.Choroplethmapbox(
+            geojson=feature_collection(feature_index, df_other['Регион']),
+            locations=df_other['Регион'], z=[1] * len(df_other),
+            featureidkey='properties.name',
+            colorscale=[[0, '#B0C4DE'], [1, '#B0C4DE']], showscale=False, marker_opacity=0.4,
+            marker_line_width=0.3, marker_line_color='#555555', name='Другие ЮЦ',
+            customdata=df_other[['Hover_Text']], hovertemplate="%{customdata[0]}<extra></extra>"
+        ))
+
+    if not df_zero_selected.empty:
+        fig_map.add_trace(go.Choroplethmapbox(
+            geojson=feature_collection(feature_index, df_zero_selected['Регион']),
+            locations=df_zero_selected['Регион'], z=[1] * len(df_zero_selected),
+            featureidkey='properties.name',
+            colorscale=[[0, 'gray'], [1, 'gray']], showscale=False, marker_opacity=0.6,
+            marker_line_width=0.3, marker_line_color='#555555', name='Нет юриста',
+            customdata=df_zero_selected[['Hover_Text']], hovertemplate="%{customdata[0]}<extra></extra>"
+        ))
+
+    fig_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, height=800, mapbox_zoom=2.2,
+                          mapbox_center={"lat": 65, "lon": 100})
+    return fig_map
+
+
+def build_map_layers_figure(layers, region_to_yuc, feature_index, selected_yuc):
+    # Все слои год × тип (pipeline.map_layers по регионам feature_index) в одной фигуре: выбор в меню карты
+    # меняет раскраску и подсказки прямо в браузере, поэтому фигура не зависит от лет и типов боковой панели.
+    # Фон — все регионы (чужие ЮЦ и регионы без нагрузки), поверх — регионы выбранных ЮЦ с нагрузкой слоя
+    regions = list(feature_index)
+    region_yuc = pd.Series(regions).str.strip().map(region_to_yuc)
+    is_selected = region_yuc.isin([y.strip() for y in selected_yuc]).to_numpy()
+    selected_regions = [r for r, sel in zip(regions, is_selected) if sel]
+
+    def layer_update(layer):
+        values = layer['values'][is_selected]
+        # Регионы без нагрузки не закрашиваются (None) — под ними виден серый фон
+        z_active = [v if v > 0 else None for v in values.tolist()]
+        hover = [[text] for text in layer['hover'].tolist()]
+        hover_active = [h for h, sel in zip(hover, is_selected) if sel]
+        return {'z': [z_background, z_active], 'customdata': [hover, hover_active]}
+
+    # Начальный слой — все годы и все типы
+    active = 0
+    z_background = is_selected.astype(int).tolist()
+    initial = layer_update(layers[active])
+    fig_map = go.Figure()
+    fig_map.add_trace(go.Choroplethmapbox(
+        geojson=feature_collection(feature_index, regions), locations=regions, z=z_background,
+        featureidkey='properties.name', zmin=0, zmax=1,
+        colorscale=[[0, '#B0C4DE'], [1, 'gray']], showscale=False,
+        marker_opacity=np.where(is_selected, 0.6, 0.4).tolist(),
+        marker_line_width=0.3, marker_line_color='#555555', name='Другие ЮЦ / нет юриста',
+        customdata=initial['customdata'][0], hovertemplate="%{customdata[0]}<extra></extra>"
+    ))
+    fig_map.add_trace(go.Choroplethmapbox(
+        geojson=feature_collection(feature_index, selected_regions), locations=selected_regions,
+        z=initial['z'][1], featureidkey='properties.name',
+        colorscale="RdYlGn_r", marker_opacity=0.8, colorbar_title_text='Нагрузка',
+        marker_line_width=0.3, marker_line_color='#555555', name='Выбранные ЮЦ',
+        customdata=initial['customdata'][1], hovertemplate="%{customdata[0]}<extra></extra>"
+    ))
+
+    buttons = [dict(label=layer['label'], method='restyle', args=[layer_update(layer), [0, 1]]) for layer in layers]
+    fig_map.update_layout(
+        updatemenus=[dict(buttons=buttons, active=active, direction='down', x=0.01, y=0.99,
+                          xanchor='left', yanchor='top', bgcolor='white')],
+        mapbox_style="white-bg", margin={"r": 0, "t": 0, "l": 0, "b": 0}, height=800, mapbox_zoom=2.2,
+        mapbox_center={"lat": 65, "lon": 100})
+    return fig_map
+
@@ -0,0 +1,161 @@
+"""Пакетная выгрузка статичных HTML-отчетов по каждому ЮЦ и году без запуска сервера Streamlit.
+
+В отчете те же графики, что в дашборде: сотрудники ЮЦ, сравнение ЮЦ, тренды ЮЦ по годам и тепловая карта.
+Отчеты строятся в пуле процессов: каждый процесс один раз загружает данные и геометрию карты,
+а каждый отчет записывается на диск сразу, как готов.
+
+    python export_reports.py --output reports
+    python export_reports.py --yuc "ЮЦ 01" --years 2024 2025 --coeffs 1.5 0.7 2.0 --workers 8
+"""
+import argparse
+import html
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import pipeline
+
+ALL_TYPES = ['Судебные дела', 'Административные дела', 'Претензии']
+
+# Данные процесса-исполнителя: загружаются один раз в initializer и читаются всеми его отчетами
+_worker = {}
+
+
+def init_worker(source, map_level, weights, show_fired, plotlyjs):
+    key, fingerprints = pipeline.source_fingerprint(source)
+    # Книги к этому моменту уже разобраны главным процессом: здесь читается колоночный кэш
+    _, (df_raw, df_map_ref) = pipeline.load_sources(fingerprints)
+    cube, region_to_yuc, headcount, low_activity_set, crown_employees_set = pipeline.prepare_dataset(
+        df_raw, df_map_ref, key, backend='pandas', source=source)
+    geojson = pipeline.read_geojson()
+    _worker.update(
+        cube=cube, region_to_yuc=region_to_yuc, headcount=headcount, low_activity_set=low_activity_set,
+        crown_employees_set=crown_employees_set,
+        feature_index=pipeline.index_features(pipeline.map_level_geojson(geojson, map_level)),
+        all_yuc=pipeline.cube_values(cube, 'ЮЦ'), all_years=[int(y) for y in pipeline.cube_values(cube, 'Год')],
+        weights=weights, show_fired=show_fired, plotlyjs=plotlyjs,
+    )
+
+
+def report_figures(yuc, year):
+    from charts import (EMPLOYEE_CHART_MAX_BARS, build_employee_figure, build_employee_top_figure, build_map_figure,
+                        build_trend_figure, build_yuc_figures)
+
+    w = _worker
+    cube, weights = w['cube'], w['weights']
+    raw_emps = pd.Index(pipeline.cube_values(cube, 'Сотрудник', yuc=[yuc]), dtype=object)
+    labels = pipeline.employee_labels(raw_emps, w['crown_employees_set'], w['low_activity_set'])
+    real_names = [e for e in labels.index if w['show_fired'] or e not in w['low_activity_set']]
+
+    # Большой ЮЦ — как в дашборде: первые N сотрудников и столбец "остальные"
+    build_employees = build_employee_top_figure if len(real_names) > EMPLOYEE_CHART_MAX_BARS else build_employee_figure
+    yield "Сотрудники", build_employees(cube, [yuc], [year], ALL_TYPES, real_names, labels, w['low_activity_set'],
+                                        weights)
+    # ЮЦ сравнивается со всеми остальными центрами за тот же год
+    figs = build_yuc_figures(cube, w['all_yuc'], [year], ALL_TYPES, w['headcount'], weights)
+    titles = ["Сравнение ЮЦ: общий объем", "Сравнение ЮЦ: средняя нагрузка"] if weights else ["Сравнение ЮЦ"]
+    for title, fig in zip(titles, figs or [None]):
+        yield title, fig
+    yield "Динамика по годам", build_trend_figure(cube, [yuc], w['all_years'], ALL_TYPES, weights)
+    yield "Тепловая карта", build_map_figure(cube, w['region_to_yuc'], w['feature_index'], [yuc], [year],
+                                             ALL_TYPES, weights)
+
+
+def report_name(yuc, year):
+    name = re.sub(r'[^\w.-]+', '_', yuc).strip('_')
+    return f"{name}_{year}.html"
+
+
+def write_report(output_dir, yuc, year):
+    # Пишем во временный файл по одному графику и подменяем целиком: недописанный отчет не виден
+    path = os.path.join(output_dir, report_name(yuc, year))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    plotlyjs = _worker['plotlyjs']
+    title = html.escape(f"{yuc} — {year}")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html lang="ru">\n<head><meta charset="utf-8"><title>{title}</title></head>\n'
+                f'<body style="font-family: sans-serif">\n<h1>{title}</h1>\n')
+        if _worker['weights']:
+            coeffs = ', '.join(f"{name}: {k}" for name, k in _worker['weights'].items())
+            f.write(f"<p>С учетом коэффициентов ({html.escape(coeffs)})</p>\n")
+        for section, fig in report_figures(yuc, year):
+            f.write(f"<h2>{html.escape(section)}</h2>\n")
+            if fig is None:
+                f.write("<p>Нет данных.</p>\n")
+                continue
+            # plotly.js встраивается один раз, в первый график отчета
+            f.write(fig.to_html(full_html=False, include_plotlyjs=plotlyjs))
+            plotlyjs = False
+        f.write("</body>\n</html>\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_index(output_dir, reports):
+    rows = ''.join(f'<li><a href="{html.escape(os.path.basename(path))}">{html.escape(f"{yuc} — {year}")}</a></li>\n'
+                   for (yuc, year), path in sorted(reports.items()))
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html lang="ru">\n<head><meta charset="utf-8"><title>Отчеты по ЮЦ</title></head>\n'
+                f'<body style="font-family: sans-serif">\n<h1>Отчеты по ЮЦ</h1>\n<ul>\n{rows}</ul>\n</body>\n</html>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=pipeline.SOURCE_FILE, help="книга, каталог или шаблон книг")
+    parser.add_argument('--output', default='reports', help="каталог для отчетов")
+    parser.add_argument('--yuc', nargs='+', help="только эти ЮЦ (по умолчанию все)")
+    parser.add_argument('--years', nargs='+', type=int, help="только эти годы (по умолчанию все)")
+    parser.add_argument('--coeffs', nargs=3, type=float, metavar=('СД', 'АД', 'ПРЕТ'),
+                        help="коэффициенты судебных, административных дел и претензий")
+    parser.add_argument('--fired', action='store_true', help="показывать уволенных (⚠️) на графике сотрудников")
+    parser.add_argument('--detail', choices=list(pipeline.MAP_DETAIL_LEVELS), default='Обзорная',
+                        help="детализация границ регионов")
+    parser.add_argument('--cdn', action='store_true', help="подключать plotly.js из CDN, а не встраивать в отчет")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    key, fingerprints = pipeline.source_fingerprint(args.source)
+    if key is None:
+        parser.error(f"источник не найден: {args.source}")
+    # Разбор книг один раз здесь: процессы-исполнители прочитают уже готовый колоночный кэш
+    _, (df_raw, df_map_ref) = pipeline.load_sources(fingerprints)
+    cube = pipeline.prepare_dataset(df_raw, df_map_ref, key, backend='pandas', source=args.source)[0]
+    all_yuc = pipeline.cube_values(cube, 'ЮЦ')
+    all_years = [int(y) for y in pipeline.cube_values(cube, 'Год')]
+    yucs = [yc for yc in all_yuc if not args.yuc or yc in args.yuc]
+    years = [y for y in all_years if not args.years or y in args.years]
+    jobs = [(yc, year) for yc in yucs for year in years]
+    if not jobs:
+        parser.error("нет ЮЦ и лет для выгрузки")
+
+    weights = pipeline.coefficient_weights(bool(args.coeffs), *(args.coeffs or (1.0, 1.0, 1.0)))
+    os.makedirs(args.output, exist_ok=True)
+    workers = max(1, min(args.workers, len(jobs)))
+    reports, failed = {}, []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(args.source, args.detail, weights, args.fired,
+                                       'cdn' if args.cdn else True)) as pool:
+        futures = {pool.submit(write_report, args.output, yc, year): (yc, year) for yc, year in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            yc, year = futures[future]
+            try:
+                reports[(yc, year)] = future.result()
+            except Exception as e:
+                failed.append((yc, year))
+                print(f"[{done}/{len(jobs)}] {yc} {year}: ошибка: {e}")
+            else:
+                print(f"[{done}/{len(jobs)}] {reports[(yc, year)]}")
+
+    write_index(args.output, reports)
+    print(f"\nОтчетов: {len(reports)} из {len(jobs)} за {time.perf_counter() - start:.1f} с "
+          f"({workers} процесс.), каталог: {args.output}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1014 @@
+"""Загрузка и подготовка данных дашборда без зависимостей от Streamlit и plotly.
+
+Модуль можно импортировать из скриптов и тестов: интерфейс (app.py) только кэширует
+результаты этих функций и показывает их, графики строятся в charts.py.
+"""
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import profiling
+from profiling import span
+
+
+# --- 1. Загрузка данных ---
+# Файл книги, каталог с книгами или маска вида 'data/*.xlsx' (книги по ЮЦ и годам сливаются в один набор)
+SOURCE_FILE = os.environ.get('DASHBOARD_SOURCE', 'statistics.xlsx')
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm')
+# Книги от этого размера читаются потоково, пачками строк: память не растет с числом строк листа
+STREAMING_MIN_BYTES = int(os.environ.get('DASHBOARD_STREAMING_MB', '50')) * 2 ** 20
+STREAM_CHUNK_ROWS = 20000
+
+# 'pandas' — куб в памяти процесса; 'duckdb' — общий файл БД рядом с книгой, фильтры и суммы считает БД
+QUERY_BACKEND = os.environ.get('DASHBOARD_BACKEND', 'pandas').lower()
+MAP_FILE = 'final_russia.geojson'
+
+
+def normalize_mapping(df_mapping_raw):
+    df_mapping = pd.DataFrame()
+    reg_col, yuc_col = None, None
+    for col in df_mapping_raw.columns:
+        c_low = str(col).lower()
+        if not reg_col and any(x in c_low for x in ['регион', 'область', 'край', 'округ', 'республика']):
+            reg_col = col
+        if not yuc_col and any(x in c_low for x in ['юц', 'центр']):
+            yuc_col = col
+
+    if reg_col and yuc_col:
+        df_mapping = df_mapping_raw[[reg_col, yuc_col]].copy()
+    elif len(df_mapping_raw.columns) >= 2:
+        val = str(df_mapping_raw.iloc[0, 0])
+        if any(x in val for x in
+               ['Дальний Восток', 'Сибирь', 'Урал', 'Поволжье', 'Северо-Запад', 'Юг', 'Центр']):
+            df_mapping = df_mapping_raw.iloc[:, [1, 0]].copy()
+        else:
+            df_mapping = df_mapping_raw.iloc[:, :2].copy()
+
+    if not df_mapping.empty:
+        df_mapping.columns = ['Регион', 'ЮЦ']
+        df_mapping['Регион'] = df_mapping['Регион'].astype(str).str.strip()
+        df_mapping['ЮЦ'] = df_mapping['ЮЦ'].astype(str).str.strip()
+    return df_mapping
+
+
+def clean_stats(df_stats):
+    if not df_stats.empty:
+        # ВАЖНО: Очищаем все ключевые текстовые поля от пробелов для корректного сравнения
+        for col in ['ЮЦ', 'Регион', 'Сотрудник']:
+            if col in df_stats.columns:
+                df_stats[col] = df_stats[col].astype(str).str.strip()
+    return df_stats
+
+
+def read_workbook(file_path):
+    xls = pd.ExcelFile(file_path)
+    df_stats = pd.read_excel(xls, sheet_name=0)
+    df_stats.columns = canonical_status_columns(df_stats.columns)
+    df_mapping = pd.DataFrame()
+
+    if len(xls.sheet_names) > 1:
+        df_mapping = normalize_mapping(pd.read_excel(xls, sheet_name=1))
+
+    return clean_stats(df_stats), df_mapping
+
+
+def stream_workbook(file_path, key, chunk_rows=STREAM_CHUNK_ROWS):
+    # Лист статистики читается построчно (read_only), пачка строк переводится в длинный формат
+    # и сразу дописывается в колоночный кэш: в памяти одновременно только одна пачка.
+    # Накопленное не пересворачивается — повторы одного сотрудника суммирует куб
+    import openpyxl
+
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    stream = open_stream_sidecar(file_path, key)
+    try:
+        sheet_count = len(wb.sheetnames)
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = canonical_status_columns([f"Unnamed: {i}" if c is None else c for i, c in enumerate(header)])
+
+        # Берем только столбцы, которые попадут в длинный формат
+        keep = [c for c in ['ЮЦ', 'Сотрудник', 'Регион', FIRED_COLUMN, CROWN_COLUMN] if c in columns]
+        keep += [c for c in columns if is_metric_column(c)]
+        positions = [columns.index(c) for c in keep]
+
+        chunk = []
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i in positions]
+            if all(v is None for v in values):
+                continue
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                append_stream_sidecar(stream, stream_chunk(chunk, keep))
+                chunk = []
+        if chunk or stream['writer'] is None:
+            append_stream_sidecar(stream, stream_chunk(chunk, keep))
+        df_stats = finish_stream_sidecar(stream)
+    finally:
+        discard_stream_sidecar(stream)
+        wb.close()
+
+    df_mapping = pd.DataFrame()
+    if sheet_count > 1:
+        df_mapping = normalize_mapping(pd.read_excel(file_path, sheet_name=1))
+    write_sidecar_part(file_path, 'mapping', key, df_mapping)
+    return df_stats, df_mapping
+
+
+def stream_chunk(chunk, columns):
+    # Пустые ячейки — NaN, как у read_excel (у него и пустая строка — NaN): после astype(str) это 'nan'
+    frame = pd.DataFrame([[np.nan if v is None or v == '' else v for v in row] for row in chunk], columns=columns)
+    return stats_to_long(clean_stats(frame))
+
+
+# Длинная таблица статистики дописывается пачками в Arrow-файл колоночного кэша.
+# Текстовые измерения — словарные столбцы: словарь только растет, и каждая пачка пишет к нему дельту,
+# поэтому строки хранятся по разу на весь файл, а не на каждую строку
+def open_stream_sidecar(file_path, key):
+    path = sidecar_path(file_path, 'stats')
+    return {'key': key, 'path': path, 'tmp_path': f"{path}.{os.getpid()}.tmp",
+            'schema': None, 'sink': None, 'writer': None, 'codes': {}}
+
+
+def _start_stream_sidecar(stream, part):
+    fields = []
+    for col in part.columns:
+        if col == 'Год':
+            fields.append(pa.field(col, pa.int16()))
+        elif col == 'Value':
+            fields.append(pa.field(col, pa.float64()))
+        else:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+            stream['codes'][col] = {}
+    stream['schema'] = pa.schema(fields, metadata={b'source_hash': sidecar_stamp(stream['key']).encode()})
+    try:
+        stream['sink'] = pa.OSFile(stream['tmp_path'], 'wb')
+    except OSError:
+        # Каталог книги только для чтения: пишем во временный файл, кэш не сохраняется
+        fd, stream['tmp_path'] = tempfile.mkstemp(suffix='.arrow')
+        os.close(fd)
+        stream['path'] = None
+        stream['sink'] = pa.OSFile(stream['tmp_path'], 'wb')
+    options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    stream['writer'] = pa.ipc.new_file(stream['sink'], stream['schema'], options=options)
+
+
+def _dictionary_array(known, values):
+    # Коды пачки переводятся в коды общего словаря; новые значения дописываются в его конец
+    codes, uniques = pd.factorize(values)
+    mapping = np.array([known.setdefault(v, len(known)) for v in uniques], dtype='int32')
+    indices = mapping[codes] if len(codes) else np.array([], dtype='int32')
+    return pa.DictionaryArray.from_arrays(indices, pa.array(list(known), type=pa.string()))
+
+
+def append_stream_sidecar(stream, part):
+    if stream['writer'] is None:
+        _start_stream_sidecar(stream, part)
+    arrays = []
+    for field in stream['schema']:
+        values = part[field.name]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(_dictionary_array(stream['codes'][field.name], values.astype(str)))
+        else:
+            arrays.append(pa.array(values.to_numpy(), type=field.type))
+    stream['writer'].write_batch(pa.record_batch(arrays, schema=stream['schema']))
+
+
+def finish_stream_sidecar(stream):
+    stream['writer'].close()
+    stream['sink'].close()
+    stream['writer'] = None
+    with pa.memory_map(stream['tmp_path'], 'r') as source:
+        df_stats = sorted_categories(pa.ipc.open_file(source).read_all().to_pandas())
+    if stream['path'] is not None:
+        os.replace(stream['tmp_path'], stream['path'])
+    else:
+        os.remove(stream['tmp_path'])
+    return df_stats
+
+
+def sorted_categories(frame):
+    # Словарь потоковой копии пополняется в порядке появления значений в книге;
+    # порядок категорий задает порядок групп и легенды, поэтому сортируем как при разборе read_excel
+    for col in frame.select_dtypes('category').columns:
+        frame[col] = frame[col].cat.reorder_categories(sorted(frame[col].cat.categories))
+    return frame
+
+
+def discard_stream_sidecar(stream):
+    # Разбор прервался: недописанный файл не должен остаться рядом с книгой
+    if stream['writer'] is not None:
+        stream['writer'].close()
+        stream['sink'].close()
+        stream['writer'] = None
+    if os.path.exists(stream['tmp_path']):
+        os.remove(stream['tmp_path'])
+
+
+def sidecar_path(file_path, part, ext='arrow'):
+    root, _ = os.path.splitext(file_path)
+    return f"{root}.{part}.{ext}"
+
+
+def is_source_pattern(source):
+    return any(ch in source for ch in '*?[')
+
+
+def source_files(source):
+    if os.path.isdir(source):
+        pattern = os.path.join(source, '*')
+    elif is_source_pattern(source):
+        pattern = source
+    else:
+        return [source] if os.path.exists(source) else []
+    # '~$...' — файлы блокировки книг, открытых в Excel
+    return sorted(
+        path for path in glob.glob(pattern)
+        if path.lower().endswith(WORKBOOK_EXTENSIONS) and not os.path.basename(path).startswith('~$')
+    )
+
+
+def source_store_path(source, part, ext):
+    # Общие для всего источника файлы (например, БД куба): для каталога и маски — рядом с книгами
+    if os.path.isdir(source):
+        return os.path.join(source, f"dashboard.{part}.{ext}")
+    if is_source_pattern(source):
+        return os.path.join(os.path.dirname(source), f"dashboard.{part}.{ext}")
+    return sidecar_path(source, part, ext)
+
+
+# Версия содержимого колоночной копии: меняется вместе с разбором книги, и старые копии перечитываются.
+# 2 — общие имена столбцов статусов
+SIDECAR_FORMAT = 2
+
+
+def sidecar_stamp(key):
+    return f"{SIDECAR_FORMAT}:{key}"
+
+
+def read_sidecar(file_path, key):
+    # Колоночная копия книги (Arrow IPC) открывается через memory map, без openpyxl
+    frames = []
+    for part in ['stats', 'mapping']:
+        path = sidecar_path(file_path, part)
+        if not os.path.exists(path):
+            return None
+        try:
+            with pa.memory_map(path, 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (OSError, pa.ArrowException):
+            return None
+        meta = table.schema.metadata or {}
+        if meta.get(b'source_hash', b'').decode() != sidecar_stamp(key):
+            return None
+        frames.append(sorted_categories(table.to_pandas()))
+    return tuple(frames)
+
+
+def write_sidecar_part(file_path, part, key, frame):
+    try:
+        table = pa.Table.from_pandas(frame)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source_hash': sidecar_stamp(key).encode()})
+        path = sidecar_path(file_path, part)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException):
+        # Кэш необязателен: нечитаемые типы или каталог только для чтения просто отключают его
+        return False
+    return True
+
+
+def write_sidecar(file_path, key, df_stats, df_mapping):
+    return all([write_sidecar_part(file_path, 'stats', key, df_stats),
+                write_sidecar_part(file_path, 'mapping', key, df_mapping)])
+
+
+def parse_workbook(file_path, key):
+    if os.path.getsize(file_path) >= STREAMING_MIN_BYTES:
+        # Потоковое чтение само пишет колоночный кэш по ходу разбора
+        return stream_workbook(file_path, key)
+    df_stats, df_mapping = read_workbook(file_path)
+    write_sidecar(file_path, key, df_stats, df_mapping)
+    return df_stats, df_mapping
+
+
+def load_workbook(file_path, key):
+    cached = read_sidecar(file_path, key)
+    if cached is not None:
+        return cached
+    return parse_workbook(file_path, key)
+
+
+def merge_workbooks(parts):
+    if len(parts) == 1:
+        return parts[0]
+
+    # Столбцы годов у книг разных лет не совпадают: concat дополняет недостающие пустыми значениями.
+    # Привязка регионов из более поздних книг перекрывает ранние (как и дубликаты внутри листа)
+    stats = [df_stats for df_stats, _ in parts if not df_stats.empty]
+    mappings = [df_mapping for _, df_mapping in parts if not df_mapping.empty]
+    if any(is_long_stats(df) for df in stats):
+        # Часть книг прочитана потоково: остальные тоже переводим в длинный формат
+        df_stats = merge_long_stats([df if is_long_stats(df) else stats_to_long(df) for df in stats])
+    else:
+        df_stats = pd.concat(stats, ignore_index=True) if stats else pd.DataFrame()
+    df_mapping = pd.concat(mappings, ignore_index=True) if mappings else pd.DataFrame()
+    return df_stats, df_mapping
+
+
+def load_sources(fingerprints, previous=None):
+    # Неизмененные книги берутся из прошлой загрузки или колоночного кэша,
+    # остальные разбираются параллельно в пуле процессов (openpyxl держит GIL)
+    previous = previous or {}
+    parsed = {}
+    with span('read_sidecar'):
+        for path, key in fingerprints.items():
+            if path in previous and previous[path][0] == key:
+                parsed[path] = previous[path][1]
+            else:
+                cached = read_sidecar(path, key)
+                if cached is not None:
+                    parsed[path] = cached
+
+    todo = [path for path in fingerprints if path not in parsed]
+    with span('parse_workbooks'):
+        if len(todo) == 1:
+            parsed[todo[0]] = parse_workbook(todo[0], fingerprints[todo[0]])
+        elif todo:
+            # spawn, а не fork: пул запускается из потока многопоточного сервера, а fork копирует
+            # только текущий поток вместе с чужими захваченными блокировками
+            with ProcessPoolExecutor(max_workers=min(len(todo), os.cpu_count() or 1),
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {path: pool.submit(parse_workbook, path, fingerprints[path]) for path in todo}
+                for path, future in futures.items():
+                    try:
+                        parsed[path] = future.result()
+                    except Exception as e:
+                        raise ValueError(f"{os.path.basename(path)}: {e}") from e
+
+    files = {path: (key, parsed[path]) for path, key in fingerprints.items()}
+    with span('merge_workbooks'):
+        return files, merge_workbooks([parsed[path] for path in fingerprints])
+
+
+def file_content_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_fingerprint(file_path, hashes=None):
+    # Возвращает общий ключ источника и отпечатки отдельных книг.
+    # hashes — память путь → (mtime, размер, хеш): содержимое перечитывается, только когда файл тронули
+    hashes = {} if hashes is None else hashes
+    fingerprints = {}
+    for path in source_files(file_path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        known = hashes.get(path)
+        if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+            known = hashes[path] = (stat.st_mtime_ns, stat.st_size, file_content_hash(path))
+        fingerprints[path] = known[2]
+    # Удаленные книги не копятся в памяти
+    for path in list(hashes):
+        if path not in fingerprints:
+            hashes.pop(path, None)
+    if not fingerprints:
+        return None, fingerprints
+
+    if list(fingerprints) == [file_path]:
+        return fingerprints[file_path], fingerprints
+    h = hashlib.sha256()
+    for path, key in fingerprints.items():
+        h.update(f"{os.path.basename(path)}:{key};".encode())
+    return h.hexdigest(), fingerprints
+
+
+def new_source_state():
+    # Общее для всех сессий состояние: последний удачно разобранный источник, его книги и фоновая перезагрузка
+    return {'lock': threading.Lock(), 'key': None, 'data': None, 'files': {}, 'hashes': {},
+            'pending': None, 'failed': None, 'error': None}
+
+
+def reload_in_background(file_path, key, fingerprints, state):
+    try:
+        files, data = load_sources(fingerprints, state['files'])
+    except Exception as e:
+        with state['lock']:
+            state['pending'], state['failed'], state['error'] = None, key, str(e)
+        return
+
+    with state['lock']:
+        state['key'], state['data'], state['files'] = key, data, files
+        state['pending'], state['failed'], state['error'] = None, None, None
+
+
+def load_source(file_path, state):
+    # Возвращает данные последней удачной загрузки; исключение — только если данных еще нет совсем
+    key, fingerprints = source_fingerprint(file_path, state['hashes'])
+    if key is None:
+        raise FileNotFoundError("файл не найден")
+
+    with state['lock']:
+        if state['data'] is None:
+            # Холодный старт: разбираем синхронно, остальные сессии ждут на блокировке
+            state['files'], state['data'] = load_sources(fingerprints)
+            state['key'] = key
+        elif state['key'] != key and key not in (state['pending'], state['failed']):
+            # Источник изменился: пока новые книги разбираются, все сессии видят предыдущие данные
+            state['pending'] = key
+            threading.Thread(target=reload_in_background, args=(file_path, key, fingerprints, state),
+                             daemon=True).start()
+
+        df_stats, df_mapping = state['data']
+        return df_stats, df_mapping, state['key'], state['pending'], state['error']
+
+
+# --- 2. Геометрия карты ---
+def read_geojson(filename=MAP_FILE):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _perpendicular_distance(p, a, b):
+    (x, y), (x1, y1), (x2, y2) = p, a, b
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / (dx * dx + dy * dy) ** 0.5
+
+
+def simplify_line(points, tolerance):
+    # Дуглас — Пекер без рекурсии: концы дуги сохраняются всегда
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(start + 1, end):
+            dist = _perpendicular_distance(points[i], points[start], points[end])
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def _quantize_ring(ring, decimals):
+    points = []
+    for x, y in (c[:2] for c in ring):
+        p = (round(x, decimals), round(y, decimals))
+        if not points or points[-1] != p:
+            points.append(p)
+    if points[0] != points[-1]:
+        points.append(points[0])
+    return points
+
+
+def simplify_geojson(geojson, tolerance, decimals):
+    # 1. Квантуем координаты: общие границы соседних регионов совпадают точка в точку
+    features = []
+    rings = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        shape = []
+        for polygon in polygons:
+            quantized = [_quantize_ring(ring, decimals) for ring in polygon]
+            # Кольца меньше шага квантования вырождаются: такие острова и дыры отбрасываем
+            if len(quantized[0]) >= 4:
+                shape.append([quantized[0]] + [ring for ring in quantized[1:] if len(ring) >= 4])
+        features.append((feature, geometry['type'], shape))
+        rings.extend(ring for polygon in shape for ring in polygon)
+
+    # 2. Узлы: начала колец и точки, у которых в разных кольцах разные соседи (там расходятся границы)
+    neighbours = {}
+    for ring in rings:
+        for i in range(len(ring) - 1):
+            pair = frozenset((ring[i - 1] if i else ring[-2], ring[i + 1]))
+            neighbours.setdefault(ring[i], set()).add(pair)
+    junctions = {p for p, pairs in neighbours.items() if len(pairs) > 1}
+    junctions.update(ring[0] for ring in rings)
+
+    # 3. Упрощаем каждую дугу между узлами один раз в каноническом направлении —
+    #    соседние регионы получают одну и ту же упрощенную границу
+    simplified_arcs = {}
+
+    def simplify_arc(arc):
+        key = tuple(arc)
+        reverse_key = key[::-1]
+        canonical = min(key, reverse_key)
+        if canonical not in simplified_arcs:
+            simplified_arcs[canonical] = simplify_line(list(canonical), tolerance)
+        result = simplified_arcs[canonical]
+        return result if canonical == key else result[::-1]
+
+    def simplify_ring(ring):
+        cuts = [i for i, p in enumerate(ring[:-1]) if p in junctions] + [len(ring) - 1]
+        out = [ring[0]]
+        for start, end in zip(cuts, cuts[1:]):
+            out.extend(simplify_arc(ring[start:end + 1])[1:])
+        # Слишком мелкое кольцо не должно схлопнуться в линию
+        return out if len(out) >= 4 else ring
+
+    result = []
+    for feature, geom_type, shape in features:
+        if not shape:
+            # Регион целиком меньше шага квантования — оставляем исходную геометрию
+            result.append(feature)
+            continue
+        coords = [[[list(p) for p in simplify_ring(ring)] for ring in polygon] for polygon in shape]
+        result.append({
+            'type': 'Feature',
+            'properties': feature['properties'],
+            'geometry': {'type': geom_type, 'coordinates': coords if geom_type == 'MultiPolygon' else coords[0]},
+        })
+    return {'type': 'FeatureCollection', 'features': result}
+
+
+def geometry_size(geojson):
+    vertices = 0
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        # Замыкающую точку кольца не считаем: в исходном файле кольца бывают и незамкнутыми
+        vertices += sum(len(ring) - (ring[0] == ring[-1]) for polygon in polygons for ring in polygon)
+    size = len(json.dumps(geojson, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return vertices, size
+
+
+# Уровни детализации карты: допуск упрощения (в градусах) и число знаков после запятой у координат
+MAP_DETAIL_LEVELS = {
+    'Обзорная': (0.1, 2),
+    'Подробная': (0.01, 3),
+    'Исходная': None,
+}
+
+
+def map_level_geojson(geojson, level):
+    params = MAP_DETAIL_LEVELS[level]
+    return geojson if params is None else simplify_geojson(geojson, *params)
+
+
+def index_features(geojson):
+    return {f['properties']['name']: f for f in geojson['features']}
+
+
+def build_map_levels(geojson):
+    levels, stats = {}, []
+    for level in MAP_DETAIL_LEVELS:
+        geo = map_level_geojson(geojson, level)
+        levels[level] = index_features(geo)
+        vertices, size = geometry_size(geo)
+        stats.append({'Уровень': level, 'Вершин': vertices, 'Размер, КБ': round(size / 1024, 1)})
+    return levels, pd.DataFrame(stats)
+
+
+def feature_collection(feature_index, regions):
+    # Каждый слой получает только свои регионы: геометрия уходит в браузер один раз на карту, а не на каждый слой
+    return {'type': 'FeatureCollection', 'features': [feature_index[r] for r in regions if r in feature_index]}
+
+
+# --- 3. Подготовка и агрегация ---
+METRIC_PATTERN = r'(\d{4})\s\((.*?)\)'
+METRIC_TYPES = {
+    'СД': 'Судебные дела',
+    'АД': 'Административные дела',
+    'претензии': 'Претензии'
+}
+
+
+def is_metric_column(col):
+    return '20' in str(col) and '(' in str(col)
+
+
+def is_long_stats(df):
+    # Потоковое чтение отдает уже длинный формат
+    return 'Тип' in df.columns and 'Value' in df.columns
+
+
+def stats_to_long(df):
+    # Длинный формат со столбцами статусов (уволен / работник ЮЦ), свернутый до строки на сотрудника, год и тип:
+    # такие части можно копить пачками и сливать между книгами
+    df = df.set_axis(canonical_status_columns(df.columns), axis=1)
+    id_vars = [c for c in ['ЮЦ', 'Сотрудник', 'Регион', FIRED_COLUMN, CROWN_COLUMN] if c in df.columns]
+
+    metrics = {}
+    for col in df.columns:
+        match = re.search(METRIC_PATTERN, str(col)) if is_metric_column(col) else None
+        if match:
+            metrics[col] = (int(match.group(1)), METRIC_TYPES.get(match.group(2), match.group(2)))
+
+    frame = df[id_vars + list(metrics)].copy()
+    frame[id_vars] = frame[id_vars].astype(str)
+    long = frame.melt(id_vars=id_vars, value_vars=list(metrics), var_name='Year_Metric', value_name='Value')
+    long['Год'] = long['Year_Metric'].map({col: year for col, (year, _) in metrics.items()})
+    long['Тип'] = long['Year_Metric'].map({col: name for col, (_, name) in metrics.items()})
+    long['Value'] = pd.to_numeric(long['Value'], errors='coerce')
+    long = long.drop(columns=['Year_Metric'])
+    return long.groupby(id_vars + ['Год', 'Тип'], sort=False, as_index=False)['Value'].sum()
+
+
+def merge_long_stats(frames):
+    frame = pd.concat(frames, ignore_index=True)
+    keys = [c for c in frame.columns if c != 'Value']
+    # dropna=False: у книг из разных источников может не быть части столбцов статусов
+    return frame.groupby(keys, sort=False, as_index=False, dropna=False, observed=True)['Value'].sum()
+
+
+def preprocess_stats(df):
+    if is_long_stats(df):
+        df_long = df.reset_index(drop=True)
+    else:
+        id_vars = ['ЮЦ', 'Сотрудник']
+        if 'Регион' in df.columns:
+            id_vars.append('Регион')
+
+        value_vars = [c for c in df.columns if is_metric_column(c)]
+        df_melted = df.melt(id_vars=id_vars, value_vars=value_vars, var_name='Year_Metric', value_name='Value')
+
+        extracted = df_melted['Year_Metric'].str.extract(METRIC_PATTERN)
+        df_melted['Год'] = extracted[0].astype(float).astype('Int64')
+        df_melted['Тип'] = extracted[1].replace(METRIC_TYPES)
+
+        df_long = df_melted.dropna(subset=['Год', 'Тип']).drop(columns=['Year_Metric']).reset_index(drop=True)
+
+    # Компактное представление: измерения храним кодами категорий, числа — узкими типами.
+    # isin/groupby по категориям работают с кодами, а не с питоновскими строками
+    for col in ['ЮЦ', 'Сотрудник', 'Регион', 'Тип']:
+        if col in df_long.columns:
+            df_long[col] = df_long[col].astype('category')
+    df_long['Год'] = df_long['Год'].astype('int16')
+    df_long['Value'] = pd.to_numeric(df_long['Value'], errors='coerce').astype('float32')
+
+    return df_long
+
+
+def find_fired_column(columns):
+    # Ищем колонку, содержащую слово "уволен"
+    for col in columns:
+        if "уволен" in str(col).strip().lower():
+            return col
+    return None
+
+
+def find_crown_column(columns):
+    possible_names = ['работник юц', 'сотрудник юц', 'признак', 'статус', 'работник']
+    for col in columns:
+        if isinstance(col, str):
+            if any(key in col.lower().strip() for key in possible_names):
+                return col
+    return None
+
+
+# Общие имена столбцов статусов: в книгах разных лет столбцы называются по-разному
+# ("Уволен (отметка)", "Статус"), а после объединения книг find_*_column нашли бы только первый
+FIRED_COLUMN = 'Уволен'
+CROWN_COLUMN = 'Работник ЮЦ'
+
+
+def canonical_status_columns(columns):
+    # Столбцы статусов ищутся в каждой книге отдельно и переименовываются до объединения книг
+    columns = list(columns)
+    fired = find_fired_column(columns)
+    crown = find_crown_column([c for c in columns if c != fired])
+    renames = {}
+    for col, name in [(fired, FIRED_COLUMN), (crown, CROWN_COLUMN)]:
+        # Столбец с общим именем уже есть — он и найден, переименовывать нечего
+        if col is not None and name not in columns:
+            renames[col] = name
+    return [renames.get(c, c) for c in columns]
+
+
+def get_fired_employees(df):
+    # Столбцы статусов уже переименованы при чтении каждой книги (canonical_status_columns)
+    target_col = FIRED_COLUMN if FIRED_COLUMN in df.columns else None
+    if target_col:
+        # Ищем любой знак 'x', 'X', 'х', 'Х' (лат/кир)
+        mask = df[target_col].astype(str).str.contains(r'[xXхХ]', na=False)
+        # Возвращаем список сотрудников (уже очищенный в load_data)
+        return set(df[mask]['Сотрудник'].unique())
+    return set()
+
+
+def get_crown_employees(df):
+    target_col = CROWN_COLUMN if CROWN_COLUMN in df.columns else None
+    if target_col:
+        mask = df[target_col].astype(str).str.contains(r'[xXхХ]', na=False)
+        return set(df[mask]['Сотрудник'].unique())
+    return set()
+
+
+# Самое мелкое зерно, которое нужно вкладкам: все остальное — срез и свертка куба
+CUBE_DIMS = ['ЮЦ', 'Регион', 'Сотрудник', 'Год', 'Тип']
+
+
+def build_cube(df):
+    dims = [c for c in CUBE_DIMS if c in df.columns]
+    return df.groupby(dims, observed=True)['Value'].sum().reset_index()
+
+
+CUBE_FILTERS = {'yuc': 'ЮЦ', 'years': 'Год', 'types': 'Тип', 'employees': 'Сотрудник'}
+
+
+def cube_slice(cube, yuc=None, years=None, types=None, employees=None):
+    mask = None
+    for col, values in [('ЮЦ', yuc), ('Год', years), ('Тип', types), ('Сотрудник', employees)]:
+        if values is not None:
+            col_mask = cube[col].isin(values)
+            mask = col_mask if mask is None else mask & col_mask
+    return cube if mask is None else cube[mask]
+
+
+def cube_rollup(cube, by, weights=None, **filters):
+    if not isinstance(cube, pd.DataFrame):
+        return duckdb_rollup(cube, by, weights, **filters)
+
+    with span('cube_rollup'):
+        part = cube_slice(cube, **filters)
+        values = weighted_values(part, weights)
+        return values.groupby([part[c] for c in by], observed=True).sum().reset_index()
+
+
+def cube_values(cube, col, **filters):
+    # Отсортированные значения измерения (для боковой панели и списков выбора)
+    if not isinstance(cube, pd.DataFrame):
+        return duckdb_values(cube, col, **filters)
+    return sorted(cube_slice(cube, **filters)[col].unique())
+
+
+# --- Необязательный бэкенд: встроенная БД DuckDB ---
+# Куб лежит в файле рядом с книгой и открыт только на чтение: все сессии делят одну БД,
+# а в Python возвращаются только результаты запросов размером с график
+# Ветвление по типу DataFrame, а не по DuckDBCube: при перезагрузке модуля класс создается заново,
+# а дескриптор из кэша интерфейса остается экземпляром прежнего
+DuckDBCube = namedtuple('DuckDBCube', ['path', 'connection', 'columns'])
+
+
+def _duckdb_where(filters):
+    clauses, params = [], []
+    for name, values in filters.items():
+        if values is None:
+            continue
+        values = [v.item() if isinstance(v, np.generic) else v for v in values]
+        if not values:
+            clauses.append('FALSE')
+            continue
+        clauses.append(f'"{CUBE_FILTERS[name]}" IN ({", ".join("?" * len(values))})')
+        params.extend(values)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def duckdb_rollup(cube, by, weights=None, **filters):
+    cols = ', '.join(f'"{c}"' for c in by)
+    params = []
+    if weights is None:
+        value_expr = 'SUM("Value")'
+    else:
+        cases = ' '.join('WHEN ? THEN ?' for _ in weights)
+        value_expr = f'SUM("Value" * CASE "Тип" {cases} ELSE 1.0 END)'
+        for t, k in weights.items():
+            params.extend([t, float(k)])
+    where, where_params = _duckdb_where(filters)
+    query = f'SELECT {cols}, {value_expr} AS "Value" FROM cube{where} GROUP BY {cols} ORDER BY {cols}'
+
+    # У каждого потока свой курсор: само соединение не потокобезопасно
+    with cube.connection.cursor() as cur:
+        return cur.execute(query, params + where_params).df()
+
+
+def duckdb_values(cube, col, **filters):
+    where, params = _duckdb_where(filters)
+    with cube.connection.cursor() as cur:
+        rows = cur.execute(f'SELECT DISTINCT "{col}" FROM cube{where} ORDER BY 1', params).fetchall()
+    return [row[0] for row in rows]
+
+
+def import_duckdb():
+    # duckdb импортируется только для своего бэкенда: остальным он не нужен при старте
+    try:
+        import duckdb
+    except ImportError:
+        return None
+    return duckdb
+
+
+def open_duckdb_cube(db_path, source_key, cube):
+    duckdb = import_duckdb()
+    if duckdb is None:
+        raise ImportError("пакет duckdb не установлен")
+
+    try:
+        with duckdb.connect(db_path, read_only=True) as con:
+            current = con.execute('SELECT source_hash FROM meta').fetchone()[0]
+    except (duckdb.Error, TypeError):
+        current = None
+
+    if current != source_key:
+        # Собираем во временный файл и подменяем целиком: читатели не видят недостроенную БД
+        tmp_path = f"{db_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with duckdb.connect(tmp_path) as con:
+            con.register('cube_df', cube)
+            con.execute('CREATE TABLE cube AS SELECT * FROM cube_df ORDER BY "ЮЦ", "Год"')
+            con.execute('CREATE TABLE meta AS SELECT ? AS source_hash', [source_key])
+        os.replace(tmp_path, db_path)
+
+    return DuckDBCube(db_path, duckdb.connect(db_path, read_only=True), list(cube.columns))
+
+
+def duckdb_cube_path(source, source_key):
+    # Своя БД на каждую версию источника: DuckDB держит один экземпляр базы на путь, и пока открыт
+    # куб прошлой версии, повторное подключение к тому же файлу вернуло бы старые таблицы
+    return source_store_path(source, f"cube.{source_key[:16]}", 'duckdb')
+
+
+def release_dataset(dataset):
+    # Набор данных ушел из кэша интерфейса: файл его версии куба больше не нужен.
+    # Соединение не закрываем — им еще может пользоваться идущий перезапуск; оно закроется вместе с объектом
+    cube = dataset[0]
+    if isinstance(cube, pd.DataFrame):
+        return
+    try:
+        os.remove(cube.path)
+    except OSError:
+        pass
+
+
+def build_region_index(df, df_map_ref):
+    # Регион → ЮЦ: сначала лист соответствий (при повторах побеждает последняя строка),
+    # затем недостающие регионы из самих данных (побеждает первая встреченная строка)
+    parts = []
+    if not df_map_ref.empty:
+        ref = df_map_ref[['Регион', 'ЮЦ']].astype(str).apply(lambda s: s.str.strip())
+        ref = ref[(ref['Регион'] != '') & (ref['ЮЦ'] != '') & (ref['Регион'] != 'nan')]
+        parts.append(ref.drop_duplicates('Регион', keep='last'))
+
+    if 'Регион' in df.columns:
+        own = df[['Регион', 'ЮЦ']].astype(str).drop_duplicates('Регион', keep='first')
+        own = own[(own['Регион'] != '') & (own['ЮЦ'] != '') & (own['Регион'] != 'nan')]
+        if parts:
+            own = own[~own['Регион'].isin(parts[0]['Регион'])]
+        parts.append(own)
+
+    if not parts:
+        return {}
+    index = pd.concat(parts)
+    return dict(zip(index['Регион'], index['ЮЦ']))
+
+
+def build_headcount_index(cube, low_activity_set):
+    # Активные (не уволенные) сотрудники ЮЦ: всего за все годы и по годам, где у сотрудника есть нагрузка
+    active = cube[~cube['Сотрудник'].isin(low_activity_set)]
+    total = active.groupby('ЮЦ', observed=True)['Сотрудник'].nunique()
+    by_year = active.loc[active['Value'] > 0, ['ЮЦ', 'Год', 'Сотрудник']].drop_duplicates().reset_index(drop=True)
+    return total, by_year
+
+
+def active_headcount(headcount, selected_years=None):
+    total, by_year = headcount
+    if selected_years is None:
+        return total
+    in_years = by_year[by_year['Год'].isin(selected_years)]
+    return in_years.groupby('ЮЦ', observed=True)['Сотрудник'].nunique()
+
+
+def prepare_dataset(df_raw, df_map_ref, source_key, backend=QUERY_BACKEND, source=SOURCE_FILE):
+    # Все, что нужно вкладкам, из сырой книги: куб, привязка регионов, штат и статусы сотрудников
+    profiling.count('dataset_build')
+    with span('preprocess_stats'):
+        df = preprocess_stats(df_raw)
+    with span('status_sets'):
+        low_activity_set = get_fired_employees(df_raw)
+        crown_employees_set = get_crown_employees(df_raw)
+    with span('build_cube'):
+        cube = build_cube(df)
+    with span('region_index'):
+        region_to_yuc = build_region_index(df, df_map_ref)
+    with span('headcount_index'):
+        headcount = build_headcount_index(cube, low_activity_set)
+    if backend == 'duckdb' and import_duckdb() is not None:
+        with span('duckdb_cube'):
+            cube = open_duckdb_cube(duckdb_cube_path(source, source_key), source_key, cube)
+    return cube, region_to_yuc, headcount, low_activity_set, crown_employees_set
+
+
+def coefficient_weights(use_coeffs, k_sd, k_ad, k_pr):
+    if not use_coeffs:
+        return None
+    return {'Судебные дела': k_sd, 'Административные дела': k_ad, 'Претензии': k_pr}
+
+
+def weighted_values(frame, weights):
+    if weights is None:
+        return frame['Value']
+
+    # Вектор весов по кодам категории 'Тип': одно умножение вместо копии таблицы и масок по каждому типу.
+    # Дробные коэффициенты считаем в float64, чтобы не тянуть погрешность float32 в подписи
+    types = frame['Тип'].cat
+    w = np.array([weights.get(t, 1.0) for t in types.categories], dtype='float64')
+    return pd.Series(frame['Value'].to_numpy(dtype='float64') * w[types.codes.to_numpy()],
+                     index=frame.index, name='Value')
+
+
+def format_values(values, use_coeffs):
+    # Векторное форматирование: те же правила, что у f"{v:.1f}" и int(v)
+    if use_coeffs:
+        return np.char.mod('%.1f', values.to_numpy(dtype='float64'))
+    return np.char.mod('%d', values.to_numpy(dtype='float64').astype('int64'))
+
+
+def build_hover_texts(df_plot, types, use_coeffs):
+    head = "<b>" + df_plot['Регион'].astype(str) + "</b>"
+    text = head
+    for t in types:
+        text = text + f"<br>{t}: " + format_values(df_plot[t], use_coeffs)
+    text = text + "<br>Всего: " + format_values(df_plot['Value'], use_coeffs)
+    return np.where(df_plot['Value'] == 0, head + "<br>нет юриста", text)
+
+
+def map_frame(cube, region_to_yuc, regions, selected_yuc, selected_years, types, weights):
+    # Таблица для карты: по строке на каждый регион карты с нагрузкой по типам, подсказкой и привязкой к ЮЦ
+    use_coeffs = weights is not None
+    grp_map = cube_rollup(cube, ['Регион', 'Тип'], weights, years=selected_years)
+
+    if grp_map.empty:
+        df_pivot = pd.DataFrame(columns=['Регион', 'Судебные дела', 'Административные дела', 'Претензии'])
+    else:
+        df_pivot = grp_map.pivot(index='Регион', columns='Тип', values='Value').fillna(0).reset_index()
+
+    for col in ['Судебные дела', 'Административные дела', 'Претензии']:
+        if col not in df_pivot.columns:
+            df_pivot[col] = 0
+
+    df_full = pd.DataFrame({'Регион': list(regions)})
+
+    df_plot = pd.merge(df_full, df_pivot, on='Регион', how='left').fillna(0)
+    df_plot['Value'] = df_plot[types].sum(axis=1)
+
+    with span('hover_text'):
+        df_plot['Hover_Text'] = build_hover_texts(df_plot, types, use_coeffs)
+
+    with span('region_mapping'):
+        df_plot['Регион_чистый'] = df_plot['Регион'].astype(str).str.strip()
+        df_plot['ЮЦ_карты'] = df_plot['Регион_чистый'].map(region_to_yuc)
+
+        selected_yuc_clean = [y.strip() for y in selected_yuc]
+        df_plot['Выбран'] = df_plot['ЮЦ_карты'].isin(selected_yuc_clean)
+    return df_plot
+
+
+def map_layers(cube, regions, weights):
+    # Все слои карты для переключения в браузере: каждый год и все годы × каждый тип и все типы.
+    # Одна свертка куба на набор данных, дальше слои — суммы столбцов одной таблицы
+    use_coeffs = weights is not None
+    types = ['Судебные дела', 'Административные дела', 'Претензии']
+    grp = cube_rollup(cube, ['Регион', 'Год', 'Тип'], weights)
+    table = pd.DataFrame({'Регион': grp['Регион'].astype(str), 'Год': grp['Год'].astype(int),
+                          'Тип': grp['Тип'].astype(str), 'Value': grp['Value']})
+    years = sorted(table['Год'].unique())
+
+    layers = []
+    for year in [None] + years:
+        part = table if year is None else table[table['Год'] == year]
+        totals = part.groupby(['Регион', 'Тип'])['Value'].sum().unstack('Тип')
+        df_layer = pd.DataFrame({'Регион': list(regions)})
+        for t in types:
+            df_layer[t] = df_layer['Регион'].map(totals[t]).fillna(0) if t in totals.columns else 0
+
+        for layer_types in [types] + [[t] for t in types]:
+            df_layer['Value'] = df_layer[layer_types].sum(axis=1)
+            label = f"{'Все годы' if year is None else year} · {'все типы' if len(layer_types) > 1 else layer_types[0]}"
+            layers.append({'label': label, 'year': year, 'types': layer_types,
+                           'values': df_layer['Value'].to_numpy(dtype='float64'),
+                           'hover': build_hover_texts(df_layer, layer_types, use_coeffs)})
+    return layers
+
+
+def employee_labels(employees, crown_employees_set, low_activity_set):
+    # Подписи со статусами (👑/⚠️) для всех сотрудников сразу, индекс — настоящее имя
+    names = pd.Index(employees, dtype=object)
+    crown = pd.Series(np.where(names.isin(crown_employees_set), "👑 ", ""), index=names)
+    low = pd.Series(np.where(names.isin(low_activity_set), "⚠️ ", ""), index=names)
+    return crown + low + names.to_series()
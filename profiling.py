@@ -0,0 +1,120 @@
+"""Замер стадий перезапуска скрипта: именованные интервалы, счетчики и журнал JSONL.
+
+Выключено по умолчанию. DASHBOARD_PROFILE=1 включает панель профиля в разделах дашборда,
+DASHBOARD_PROFILE_LOG=путь — журнал с одной записью на перезапуск. В выключенном состоянии span()
+возвращает общий пустой контекст и ничего не замеряет.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_PATH = os.environ.get('DASHBOARD_PROFILE_LOG')
+SHOW_PANEL = os.environ.get('DASHBOARD_PROFILE', '') not in ('', '0')
+ENABLED = SHOW_PANEL or bool(LOG_PATH)
+
+_NULL = contextlib.nullcontext()
+# Запись текущего перезапуска: у каждой сессии Streamlit скрипт выполняется в своем потоке
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def _active():
+    return getattr(_local, 'record', None)
+
+
+@contextlib.contextmanager
+def _measure(name):
+    record = _active()
+    if record is None:
+        yield
+        return
+    entry = {'name': name, 'depth': record['depth'], 'ms': None}
+    record['spans'].append(entry)
+    record['depth'] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry['ms'] = round((time.perf_counter() - start) * 1000, 3)
+        record['depth'] -= 1
+
+
+def span(name):
+    return _measure(name) if ENABLED else _NULL
+
+
+def count(name):
+    record = _active() if ENABLED else None
+    if record is not None:
+        record['counters'][name] = record['counters'].get(name, 0) + 1
+
+
+def begin_rerun(label, **fields):
+    if not ENABLED:
+        return
+    # Незавершенная запись (скрипт прервали исключением или st.stop) просто отбрасывается
+    _local.record = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'label': label, **fields,
+        'spans': [], 'counters': {}, 'depth': 0, 'start': time.perf_counter(),
+    }
+
+
+def annotate(**fields):
+    record = _active() if ENABLED else None
+    if record is not None:
+        record.update(fields)
+
+
+def end_rerun():
+    record = _active()
+    if record is None:
+        return None
+    _local.record = None
+    result = snapshot(record)
+    write_log(result)
+    return result
+
+
+@contextlib.contextmanager
+def _rerun(label, **fields):
+    # Словарь заполняется завершенной записью на выходе из блока
+    finished = {}
+    if _active() is not None:
+        # Фрагмент внутри полного перезапуска — обычный вложенный интервал, своей записи нет
+        with _measure(label):
+            yield finished
+        return
+    begin_rerun(label, **fields)
+    try:
+        yield finished
+    finally:
+        finished.update(end_rerun() or {})
+
+
+def rerun(label, **fields):
+    # Отдельная запись для перезапуска фрагмента (или интервал, если идет полный перезапуск)
+    return _rerun(label, **fields) if ENABLED else _NULL
+
+
+def snapshot(record=None):
+    record = record or _active()
+    if record is None:
+        return None
+    result = {k: v for k, v in record.items() if k not in ('depth', 'start')}
+    result['total_ms'] = round((time.perf_counter() - record['start']) * 1000, 3)
+    result['spans'] = [dict(s) for s in record['spans']]
+    result['counters'] = dict(record['counters'])
+    return result
+
+
+def write_log(record):
+    if not LOG_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _log_lock:
+        with open(LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')